@@ -0,0 +1,202 @@
+# bench/loadtest.py
+#
+# Нагрузочный тест (NFR002 — /newpost за 5 секунд, NFR003 — 100+ пользователей одновременно).
+# Собирает настоящий Application из bot.py, прогоняет через него синтетических пользователей
+# по сценарию /start → /choose_channel → канал → /newpost → идея → стиль → подтверждение
+# и считает p50/p95/p99 по каждому обработчику и общую пропускную способность.
+#
+# Telegram и OpenAI подменяются локальным stub-сервером (bench/stub_server.py),
+# база — та, что указана в config.py (используйте отдельную тестовую БД).
+#
+# Запуск из папки ai_telegram_bot:
+#   python -m bench.loadtest --users 1000 --concurrency 100 --llm-latency 1.0
+
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+from collections import defaultdict
+from telegram import Update
+from telegram.ext import Application
+from bot import build_application
+from services import database as db
+from services import llm, completion_cache
+from bench.stub_server import StubServer
+
+BENCH_TOKEN = "123456:BENCH"
+SEED_POSTS = [
+    "Первый пост канала про утренний кофе и хорошее настроение.",
+    "Второй пост: подборка мест, куда стоит съездить на выходных.",
+    "Третий пост с рекомендацией книги недели.",
+]
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+# -------------------------
+# Синтетические апдейты
+# -------------------------
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"bench{user_id}"}
+
+
+def _message(user_id: int, text: str) -> dict:
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return message
+
+
+def message_update(bot, user_id: int, text: str) -> Update:
+    return Update.de_json({"update_id": next(_update_ids), "message": _message(user_id, text)}, bot)
+
+
+def callback_update(bot, user_id: int, data: str) -> Update:
+    update_id = next(_update_ids)
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": _message(user_id, "bench"),
+        },
+    }, bot)
+
+
+# -------------------------
+# Сценарий пользователя
+# -------------------------
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = 0
+        self.flows = 0
+
+    async def step(self, application: Application, name: str, update: Update):
+        started = time.perf_counter()
+        await application.process_update(update)
+        self.latencies[name].append(time.perf_counter() - started)
+
+
+async def user_flow(application: Application, stats: Stats, user_id: int, think: float):
+    bot = application.bot
+    channel_name = f"bench-{user_id}"
+
+    await stats.step(application, "start", message_update(bot, user_id, "/start"))
+
+    db_user = await db.get_user(user_id)
+    channel = await db.add_channel(db_user["user_id"], channel_name)
+    # Посты уникальны для каждого пользователя, чтобы кэши LLM не искажали замер
+    await db.add_posts_bulk(
+        channel["channel_id"], [("bench", "Инфо", f"{text} #{user_id}") for text in SEED_POSTS]
+    )
+
+    steps = [
+        ("choose_channel", message_update, "/choose_channel"),
+        ("text_parser", message_update, channel_name),
+        ("newpost_command", message_update, "/newpost"),
+        ("choose_idea", callback_update, "idea_0"),
+        ("choose_style", callback_update, "style_Инфо"),
+        ("confirm_draft", callback_update, "confirm_draft"),
+    ]
+    for name, make_update, payload in steps:
+        if think:
+            await asyncio.sleep(think)
+        await stats.step(application, name, make_update(bot, user_id, payload))
+
+    stats.flows += 1
+
+
+# -------------------------
+# Отчёт
+# -------------------------
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def report(stats: Stats, elapsed: float, stub: StubServer):
+    print()
+    print(f"{'handler':<18}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    total_updates = 0
+    for name, values in stats.latencies.items():
+        total_updates += len(values)
+        print(
+            f"{name:<18}{len(values):>8}"
+            f"{percentile(values, 50):>10.3f}{percentile(values, 95):>10.3f}"
+            f"{percentile(values, 99):>10.3f}{max(values):>10.3f}"
+        )
+
+    print()
+    print(f"flows completed: {stats.flows}, handler errors: {stats.errors}")
+    print(f"elapsed: {elapsed:.1f}s, throughput: {stats.flows / elapsed:.1f} flows/s, {total_updates / elapsed:.1f} updates/s")
+    print(f"stub calls: {dict(stub.calls)}")
+    print(f"llm session: {llm.get_session_stats()}")
+    print(f"llm response cache: {completion_cache.stats()}")
+    print(f"db cache: {db.cache_stats()}")
+
+
+async def run(args):
+    stub = StubServer(args.llm_latency, args.stream_chunks)
+    base_url = await stub.start(port=args.stub_port)
+    llm.OPENAI_API_URL = f"{base_url}/v1/chat/completions"
+    llm.PROXY_URL = ""
+
+    builder = Application.builder().token(BENCH_TOKEN).base_url(f"{base_url}/bot").updater(None)
+    application = build_application(builder)
+
+    stats = Stats()
+
+    async def on_error(update, context):
+        stats.errors += 1
+        logging.getLogger(__name__).error("Handler error: %s", context.error)
+
+    application.add_error_handler(on_error)
+
+    await application.initialize()
+    await application.post_init(application)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    first_user_id = args.first_user_id or int(time.time()) * 1000
+
+    async def limited(user_id):
+        async with semaphore:
+            await user_flow(application, stats, user_id, args.think)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(limited(first_user_id + i) for i in range(args.users)))
+    finally:
+        elapsed = time.perf_counter() - started
+        report(stats, elapsed, stub)
+        await application.post_stop(application)
+        await application.post_shutdown(application)
+        await application.shutdown()
+        await stub.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на stub Telegram/OpenAI")
+    parser.add_argument("--users", type=int, default=1000, help="сколько синтетических пользователей")
+    parser.add_argument("--concurrency", type=int, default=100, help="сколько пользователей одновременно")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="задержка ответа LLM, сек")
+    parser.add_argument("--stream-chunks", type=int, default=20, help="на сколько кусочков делить стрим черновика")
+    parser.add_argument("--think", type=float, default=0.0, help="пауза пользователя между шагами, сек")
+    parser.add_argument("--stub-port", type=int, default=8081)
+    parser.add_argument("--first-user-id", type=int, default=0, help="telegram_id первого пользователя")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    asyncio.run(run(args))
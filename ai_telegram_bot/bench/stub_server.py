@@ -0,0 +1,124 @@
+# bench/stub_server.py
+#
+# Локальный stub для нагрузочного теста: отвечает за Telegram Bot API и OpenAI,
+# чтобы гонять бота без сети. Задержку LLM можно настраивать.
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from aiohttp import web
+
+IDEAS_RESPONSE = (
+    "1. Утренний кофе\n   - Инфо\n   - Юмор\n   - Серьёзный\n"
+    "2. Путешествия\n   - Инфо\n   - Юмор\n   - Серьёзный\n"
+    "3. Книги недели\n   - Инфо\n   - Юмор\n   - Серьёзный\n"
+)
+DRAFT_RESPONSE = (
+    "Это тестовый черновик поста для нагрузочного теста. "
+    "Он достаточно длинный, чтобы прийти в несколько кусочков при стриминге. "
+) * 3
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+class StubServer:
+    def __init__(self, llm_latency: float = 1.0, stream_chunks: int = 20):
+        self.llm_latency = llm_latency
+        self.stream_chunks = stream_chunks
+        self.calls = Counter()
+        self._message_id = 0
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_post("/v1/chat/completions", self.chat_completions)
+        self.app.router.add_post("/bot{token}/{method}", self.bot_api)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> str:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    # -------------------------
+    # OpenAI
+    # -------------------------
+    async def chat_completions(self, request: web.Request):
+        payload = await request.json()
+        prompt = payload["messages"][-1]["content"]
+        content = IDEAS_RESPONSE if "Сгенерируй 3 новые идеи" in prompt else DRAFT_RESPONSE
+        self.calls["llm_stream" if payload.get("stream") else "llm"] += 1
+
+        if not payload.get("stream"):
+            await asyncio.sleep(self.llm_latency)
+            return web.json_response({
+                "choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        step = max(1, len(content) // self.stream_chunks)
+        delay = self.llm_latency / self.stream_chunks
+        for i in range(0, len(content), step):
+            await asyncio.sleep(delay)
+            chunk = {"choices": [{"delta": {"content": content[i:i + step]}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    # -------------------------
+    # Telegram Bot API
+    # -------------------------
+    async def bot_api(self, request: web.Request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+
+        if method == "getMe":
+            return self._ok(BOT_USER)
+
+        if method in ("sendMessage", "editMessageText"):
+            if method == "sendMessage":
+                self._message_id += 1
+                message_id = self._message_id
+            else:
+                message_id = int(params.get("message_id", 0))
+
+            return self._ok({
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            })
+
+        return self._ok(True)
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({"ok": True, "result": result})
+
+
+async def _serve(args):
+    server = StubServer(args.llm_latency, args.stream_chunks)
+    url = await server.start(args.host, args.port)
+    print(f"Stub Telegram/OpenAI server on {url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Telegram Bot API + OpenAI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="задержка ответа LLM, сек")
+    parser.add_argument("--stream-chunks", type=int, default=20, help="на сколько кусочков делить стрим")
+    asyncio.run(_serve(parser.parse_args()))
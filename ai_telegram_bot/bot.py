@@ -1,26 +1,154 @@
+import asyncio
 import logging
+import multiprocessing
+import signal
+import sys
+import threading
 from telegram.ext import Application
-from services import database
-from config import TELEGRAM_TOKEN, WEBHOOK_URL
+from services import database, llm, completion_cache, update_queue, jobs, metrics, event_log
+from services.executor import executor
+from services.persistence import PostgresPersistence
+from config import TELEGRAM_TOKEN, WEBHOOK_URL, WEBHOOK_PORT, PERSISTENCE_ENABLED, BOT_MODE, QUEUE_WORKERS, QUEUE_RESTART_DELAY, METRICS_PORT
 from handlers import start, newpost, addposts
+from handlers import jobs as job_handlers
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     level=logging.INFO,
 )
 
-def main():
-    database.init_db()
+async def on_startup(application: Application):
+    await database.init_db()
+    await llm.init_session()
+    event_log.start()
+    await jobs.start(application.bot)
+    await start.resume_channel_purges()
+
+
+async def on_stop(application: Application):
+    # Воркеры задач ещё пользуются ботом, поэтому останавливаем их до Application.shutdown()
+    await jobs.stop()
+
+
+async def on_shutdown(application: Application):
+    logging.getLogger(__name__).info("LLM connection stats: %s", llm.get_session_stats())
+    logging.getLogger(__name__).info("LLM dispatch stats: %s", llm.get_dispatch_stats())
+    logging.getLogger(__name__).info("LLM response cache stats: %s", completion_cache.stats())
+    logging.getLogger(__name__).info("DB cache stats: %s", database.cache_stats())
+    logging.getLogger(__name__).info("Blocking executor stats: %s", executor.stats())
+    await event_log.stop()
+    logging.getLogger(__name__).info("Event log stats: %s", event_log.stats())
+    await llm.close_session()
+    await database.close_db()
+    executor.shutdown()
+
 
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+def build_application(builder=None) -> Application:
+    """
+    Собирает Application со всеми обработчиками.
+    builder можно передать свой (например, для нагрузочного теста со stub-сервером).
+    """
+    builder = builder or Application.builder().token(TELEGRAM_TOKEN)
+    if PERSISTENCE_ENABLED:
+        builder = builder.persistence(PostgresPersistence())
+    if metrics.enabled:
+        builder = builder.request(metrics.TelegramRequest())
+    application = builder.post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown).build()
 
     start.setup_start_handlers(application)
     newpost.setup_newpost_handlers(application)
     addposts.setup_addposts_handlers(application)
+    job_handlers.setup_job_handlers(application)
+    return application
+
+
+async def _run_worker(shard: int):
+    application = build_application(Application.builder().token(TELEGRAM_TOKEN).updater(None))
+    consumer = update_queue.QueueConsumer(application, shard)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, consumer.stop)
+
+    # initialize() читает persistence, shutdown() сбрасывает её — поэтому хуки вызываем вокруг вручную
+    async with application:
+        await on_startup(application)
+        await application.start()
+        try:
+            await consumer.run()
+        finally:
+            await application.stop()
+            await on_stop(application)
+    await on_shutdown(application)
+
+
+def run_worker(shard: int):
+    """
+    Процесс-воркер: разбирает из очереди апдейты своего шарда.
+    Можно запускать и отдельно (на другой машине): python bot.py worker <номер шарда>
+    """
+    metrics.start_server(METRICS_PORT + 1 + shard)
+    asyncio.run(_run_worker(shard))
+
+
+def _supervise(ctx, workers: list, stopping: threading.Event):
+    """
+    Перезапускает упавшие процессы-воркеры: иначе апдейты их шарда копились бы в очереди без владельца.
+    """
+    while not stopping.wait(QUEUE_RESTART_DELAY):
+        for shard, worker in enumerate(workers):
+            if worker.is_alive():
+                continue
+            logging.getLogger(__name__).warning(
+                "Worker %s exited with code %s, restarting", shard, worker.exitcode
+            )
+            workers[shard] = ctx.Process(target=run_worker, args=(shard,), name=f"worker-{shard}")
+            workers[shard].start()
+
+
+def run_queue_mode():
+    """
+    Приёмник вебхуков в этом процессе + QUEUE_WORKERS процессов-воркеров.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    workers = [
+        ctx.Process(target=run_worker, args=(shard,), name=f"worker-{shard}")
+        for shard in range(QUEUE_WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+
+    stopping = threading.Event()
+    supervisor = threading.Thread(target=_supervise, args=(ctx, workers, stopping), daemon=True)
+    supervisor.start()
+
+    metrics.start_server()
+    try:
+        update_queue.run_receiver()
+    finally:
+        stopping.set()
+        supervisor.join()
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "worker":
+        run_worker(int(sys.argv[2]))
+        return
+
+    if BOT_MODE == "queue":
+        run_queue_mode()
+        return
+
+    application = build_application()
+    metrics.start_server()
 
     application.run_webhook(
         listen="0.0.0.0",
-        port=8443,
+        port=WEBHOOK_PORT,
         url_path=TELEGRAM_TOKEN,
         webhook_url=f"{WEBHOOK_URL}/{TELEGRAM_TOKEN}",
     )
@@ -3,6 +3,35 @@ TELEGRAM_TOKEN = ""
 
 # OpenAI
 OPENAI_API_KEY = ""
+OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
+LLM_POOL_SIZE = 100             # всего соединений в пуле aiohttp
+LLM_POOL_PER_HOST = 20          # соединений на один хост
+LLM_KEEPALIVE_TIMEOUT = 60      # сколько секунд держать простаивающее соединение
+LLM_MAX_CONCURRENCY = 20        # одновременных запросов к OpenAI на весь бот
+LLM_PER_USER_CONCURRENCY = 3    # одновременных запросов от одного пользователя
+LLM_RPM_LIMIT = 500             # лимит запросов в минуту по тарифу OpenAI
+LLM_CONNECT_TIMEOUT = 5         # таймаут на установку соединения (сек)
+LLM_READ_TIMEOUT = 30           # таймаут ожидания очередной порции ответа (сек)
+LLM_TOTAL_TIMEOUT = 60          # общий таймаут обычного (не потокового) запроса (сек)
+LLM_MAX_RETRIES = 3             # сколько раз повторять запрос при 429/5xx/обрыве
+LLM_BACKOFF_BASE = 0.5          # базовая пауза между повторами (сек), растёт экспоненциально
+LLM_BACKOFF_MAX = 10            # максимальная пауза между повторами (сек)
+LLM_BREAKER_THRESHOLD = 5       # после скольких сбоев подряд перестать ходить в OpenAI
+LLM_BREAKER_COOLDOWN = 30       # сколько секунд не ходить в OpenAI после срабатывания
+LLM_CACHE_TTL = 7 * 24 * 3600   # сколько хранить готовые ответы LLM (сек)
+LLM_CACHE_MEMORY_SIZE = 1000    # ответов в памяти процесса
+LLM_CACHE_MAX_ROWS = 50_000     # ответов в Postgres, самые давно не использованные вытесняются
+PROMPT_HISTORY_TOKEN_BUDGET = 1500  # сколько токенов промпта отдавать под прошлые посты канала
+PROMPT_POST_TOKEN_LIMIT = 400       # максимум токенов на один прошлый пост (длинные обрезаются)
+EMBEDDING_DIM = 512             # размер хешированного вектора поста для поиска похожих (менять — только с пересчётом posts.embedding)
+RETRIEVAL_TOP_K = 5             # сколько самых похожих на идею постов класть в промпт черновика
+RETRIEVAL_INDEX_CACHE_SIZE = 200    # сколько каналов держать индекс векторов в памяти
+RETRIEVAL_INDEX_MAX_BYTES = 256 * 1024 * 1024  # и сколько памяти всего под эти индексы (~1 КБ на пост)
+SUGGESTIONS_REFRESH_DELAY = 10  # через сколько секунд после нового поста пересчитывать идеи канала в фоне
+SPECULATIVE_DRAFTS = False      # генерировать черновики для всех стилей сразу после выбора идеи
+SPECULATIVE_DRAFTS_TTL = 900    # сколько хранить заготовленные черновики, если пользователь ушёл из диалога (сек)
+SPECULATIVE_DRAFTS_MAX_USERS = 10_000  # для скольких пользователей одновременно держать заготовленные черновики
+DRAFT_EDIT_INTERVAL = 1.5       # минимальная пауза между правками сообщения при стриминге черновика (сек)
 
 # Proxy
 PROXY_URL = ""
@@ -13,6 +42,55 @@ DB_PORT = "5432"            # стандартный порт
 DB_NAME = "name"            # имя базы
 DB_USER = "postgres"        # имя пользователя (по умолчанию postgres)
 DB_PASSWORD = "****"        # пароль от Postgres
+DB_POOL_MIN_SIZE = 2        # минимум соединений в пуле
+DB_POOL_MAX_SIZE = 20       # максимум соединений в пуле
+DB_CACHE_MAX_SIZE = 10_000  # сколько записей держать в кэше пользователей/каналов
+DB_CACHE_TTL = 300          # время жизни записи в кэше (сек)
+BLOCKING_WORKERS = 4        # потоков для блокирующей работы (разбор файлов и т.п.)
+
+# Сохранение состояния диалогов (user_data, ConversationHandler) в Postgres
+PERSISTENCE_ENABLED = True
+PERSISTENCE_UPDATE_INTERVAL = 5     # как часто PTB сбрасывает изменения в хранилище (сек)
+PERSISTENCE_RETRY_DELAY = 5         # пауза перед повторной записью после ошибки хранилища (сек)
+PERSISTENCE_REFRESH = False         # перечитывать user_data из БД перед каждым апдейтом (несколько воркеров без привязки пользователя)
+
+# Импорт постов из файлов
+IMPORT_CHUNK_SIZE = 500         # сколько постов вставлять за один заход
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024     # максимальный размер файла (Bot API всё равно не отдаёт больше 20 МБ)
+IMPORT_MAX_ROWS = 100_000                   # максимальное число постов в одном файле
+IMPORT_MEMORY_BUFFER = 5 * 1024 * 1024      # файлы меньше держим в памяти, больше — во временном файле
+DEDUP_NEAR_THRESHOLD = 0.85     # сходство (оценка Жаккара по MinHash), начиная с которого пост считается почти дубликатом
+DEDUP_NUM_PERM = 64             # длина подписи MinHash
+DEDUP_BANDS = 16                # полос LSH (DEDUP_NUM_PERM должно делиться на это число)
+DEDUP_SEED_LIMIT = 20_000       # со сколькими последними постами канала сверять импорт на почти-дубликаты
+
+# Журнал событий (таблица logs)
+EVENT_LOG_BATCH_SIZE = 200      # сколько событий писать одним INSERT
+EVENT_LOG_FLUSH_INTERVAL = 2    # как часто сбрасывать накопленные события (сек)
+EVENT_LOG_MAX_BUFFER = 10_000   # больше событий в памяти не держим — новые отбрасываются (со счётчиком)
+
+# Фоновые задачи (импорт файлов и т.п.)
+JOB_WORKERS = 2                 # сколько задач один процесс выполняет одновременно
+JOB_POLL_INTERVAL = 2           # как часто проверять очередь задач (сек)
+JOB_PROGRESS_INTERVAL = 2       # как часто обновлять сообщение с прогрессом и проверять отмену (сек)
+JOB_STALE_AFTER = 600           # задача без обновлений прогресса дольше этого считается брошенной и перезапускается (сек)
+JOB_HEARTBEAT_INTERVAL = 60     # как часто продлевать heartbeat выполняемых задач и перезапускать брошенные (сек)
+JOB_ERROR_BACKOFF_MAX = 60      # максимальная пауза воркера после ошибки БД/Bot API (сек)
+CHANNEL_PURGE_BATCH_SIZE = 5000 # сколько постов удалённого канала стирать одной короткой транзакцией
+
+# Метрики Prometheus (нужен пакет prometheus_client)
+METRICS_ENABLED = False
+METRICS_PORT = 9100             # /metrics на этом порту; воркеры режима "queue" — на METRICS_PORT + 1 + номер шарда
+
+# Режим запуска
+BOT_MODE = "webhook"            # "webhook" — один процесс; "queue" — приёмник вебхуков + воркеры через очередь в Postgres
+WEBHOOK_PORT = 8443
+QUEUE_WORKERS = 4               # сколько процессов-воркеров разбирают очередь (апдейты одного пользователя всегда у одного воркера)
+QUEUE_BATCH_SIZE = 50           # сколько апдейтов воркер забирает из очереди за один запрос
+QUEUE_MAX_INFLIGHT = 200        # сколько апдейтов один воркер обрабатывает одновременно
+QUEUE_POLL_INTERVAL = 1.0       # как часто проверять очередь, если не пришло уведомление (сек)
+QUEUE_ERROR_BACKOFF_MAX = 30    # максимальная пауза воркера между попытками после ошибки БД (сек)
+QUEUE_RESTART_DELAY = 5         # как часто проверять, живы ли процессы-воркеры, и перезапускать упавшие (сек)
 
 # Домен
 WEBHOOK_URL = "https://....com"
\ No newline at end of file
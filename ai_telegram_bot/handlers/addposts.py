@@ -1,5 +1,4 @@
-import csv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+from telegram import Update, Document, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import (
     ContextTypes,
     ConversationHandler,
@@ -9,11 +8,18 @@ from telegram.ext import (
     filters,
 )
 from services import database as db
+from services import importer, suggestions, jobs, metrics, event_log, dedup
+from services.executor import executor, run_blocking
+from handlers.routing import consumes_update
+from config import IMPORT_CHUNK_SIZE, DEDUP_SEED_LIMIT, PERSISTENCE_ENABLED
 
 
 CHOOSING_METHOD, MANUAL_INPUT, FILE_INPUT = range(3)
 
+IMPORTED_IDEA = "Пост придуман пользователем"
 
+
+@metrics.handler
 async def addposts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.callback_query:
         query = update.callback_query
@@ -50,6 +56,7 @@ async def addposts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CHOOSING_METHOD
 
 
+@metrics.handler
 async def add_manual(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -66,6 +73,7 @@ async def add_manual(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return MANUAL_INPUT
 
 
+@metrics.handler
 async def save_manual_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
     channel = context.user_data["selected_channel"]
     text = update.message.text
@@ -76,7 +84,16 @@ async def save_manual_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
         text = parts[0].strip()
         style = parts[1].strip()
 
-    db.add_post(channel["channel_id"], "Пост придуман пользователем", style, text)
+    post, created = await db.add_post(channel["channel_id"], IMPORTED_IDEA, style, text)
+    if not created:
+        await update.message.reply_text(
+            f"♻ Такой пост в канале '{channel['name']}' уже есть — пропущен как повтор.\n\n"
+            "Отправьте следующий пост или нажмите кнопку /done, чтобы завершить добавление."
+        )
+        return MANUAL_INPUT
+
+    event_log.log_event(channel["user_id"], "post_added", post["post_id"])
+    suggestions.schedule_refresh(channel["channel_id"])
 
     await update.message.reply_text(
         f"✅ Пост сохранён в канал '{channel['name']}' со стилем '{style}'.\n\n"
@@ -86,6 +103,7 @@ async def save_manual_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return MANUAL_INPUT
 
 
+@metrics.handler
 async def done_manual(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
             [KeyboardButton("/newpost"), KeyboardButton("/addposts")],
@@ -100,6 +118,7 @@ async def done_manual(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+@metrics.handler
 async def done_manual_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -116,6 +135,7 @@ async def done_manual_button(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return ConversationHandler.END
 
 
+@metrics.handler
 async def add_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -135,17 +155,7 @@ async def add_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return FILE_INPUT
 
 
-def parse_line_style(line: str):
-    style = "ручной ввод"
-    if "Стиль:" in line:
-        parts = line.rsplit("Стиль:", 1)
-        text = parts[0].strip()
-        style = parts[1].strip()
-    else:
-        text = line.strip()
-    return text, style
-
-
+@metrics.handler
 async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     channel = context.user_data["selected_channel"]
     document = update.message.document
@@ -153,58 +163,91 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⚠️ Файл не найден.")
         return FILE_INPUT
 
-    file = await document.get_file()
-    file_path = await file.download_to_drive()
+    if not document.file_name.endswith((".txt", ".csv")):
+        await update.message.reply_text("⚠️ Поддерживаются только .txt и .csv файлы")
+        return FILE_INPUT
 
-    saved_posts = 0
-    if document.file_name.endswith(".txt"):
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
+    try:
+        importer.check_document(document)
+    except importer.ImportLimitError as e:
+        await update.message.reply_text(f"⚠️ {e}")
+        return FILE_INPUT
 
-        blocks = content.split("Пост:")
-        for block in blocks:
-            block = block.strip()
-            if not block:
-                continue
+    # Сам импорт идёт в фоновой задаче, обработчик только ставит её в очередь
+    progress_message = await update.message.reply_text("⏳ Файл поставлен в очередь на загрузку...")
+    job_id = await jobs.enqueue(
+        "import_posts",
+        {
+            "channel_id": channel["channel_id"],
+            "channel_name": channel["name"],
+            "user_id": channel["user_id"],
+            "document": document.to_dict(),
+        },
+        chat_id=progress_message.chat_id,
+        message_id=progress_message.message_id,
+    )
+    await progress_message.edit_reply_markup(jobs.cancel_markup(job_id))
+    return ConversationHandler.END
 
-            if "Стиль:" in block:
-                text_part, style_part = block.split("Стиль:", 1)
-                text = text_part.strip().strip('"')
-                style = style_part.strip().strip('"')
-            else:
-                text = block.strip().strip('"')
-                style = "ручной ввод"
-
-            if text:
-                db.add_post(channel["channel_id"], "Пост придуман пользователем", style, text)
-                saved_posts += 1
-
-    elif document.file_name.endswith(".csv"):
-        with open(file_path, newline="", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if row:
-                    if len(row) == 1:
-                        text, style = parse_line_style(row[0])
-                    else:
-                        text, style = row[0], row[1]
-                    db.add_post(channel["channel_id"], "Пост придуман пользователем", style, text.strip())
-                    saved_posts += 1
-    else:
-        await update.message.reply_text("⚠️ Поддерживаются только .txt и .csv файлы")
-        return FILE_INPUT
+
+@jobs.job_handler("import_posts")
+async def import_posts_job(job: jobs.Job):
+    channel_id = job.payload["channel_id"]
+    document = Document.de_json(job.payload["document"], job.bot)
+    await job.report("⏳ Загружаю посты...", cancellable=True)
+
+    # Почти-дубликаты ищем и внутри файла, и среди последних постов канала;
+    # точные повторы дополнительно отсекает уникальный индекс при вставке
+    near_duplicates = await run_blocking(
+        dedup.seeded_filter, await db.get_recent_post_texts(channel_id, DEDUP_SEED_LIMIT)
+    )
+    passed = 0
+
+    def unique_posts(stream):
+        nonlocal passed
+        for text, style in importer.iter_posts(stream, document.file_name):
+            if near_duplicates.is_duplicate(text):
+                continue
+            passed += 1
+            yield IMPORTED_IDEA, style, text
+
+    try:
+        async with importer.open_document(document) as stream:
+            posts = unique_posts(stream)
+            saved_posts = await db.add_posts_bulk(
+                channel_id,
+                executor.iterate(posts, IMPORT_CHUNK_SIZE),
+                on_progress=lambda saved: job.progress(saved, f"⏳ Загружено постов: {saved}..."),
+            )
+    except importer.ImportLimitError as e:
+        await job.report(f"⚠️ {e}. Ничего не сохранено, разбейте файл на части.")
+        return {"saved": 0, "error": str(e)}
+    except UnicodeDecodeError:
+        await job.report("⚠️ Файл должен быть в кодировке UTF-8.")
+        return {"saved": 0, "error": "encoding"}
+    except jobs.JobCancelled:
+        await job.report("🚫 Загрузка отменена, ничего не сохранено.")
+        raise
+
+    duplicates = near_duplicates.skipped + (passed - saved_posts)
+    event_log.log_event(job.payload.get("user_id"), "posts_imported")
+    if saved_posts:
+        suggestions.schedule_refresh(channel_id)
 
     keyboard = [
             [KeyboardButton("/newpost"), KeyboardButton("/addposts")],
             [KeyboardButton("/back")]
         ]
 
-    await update.message.reply_text(
-        f"✅ Загружено {saved_posts} постов в канал '{channel['name']}'."
-        "Теперь вы можете создать новый пост для этого канала или вернуться в главное меню.",
+    await job.report(f"✅ Файл {document.file_name} обработан.")
+    await job.bot.send_message(
+        job.chat_id,
+        f"✅ Загружено {saved_posts} постов в канал '{job.payload['channel_name']}'."
+        + (f"\n♻ Пропущено повторов: {duplicates}." if duplicates else "")
+        + "\nТеперь вы можете создать новый пост для этого канала или вернуться в главное меню.",
         reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     )
-    return ConversationHandler.END
+    return {"saved": saved_posts, "duplicates": duplicates}
 
 
 def setup_addposts_handlers(app):
@@ -216,7 +259,7 @@ def setup_addposts_handlers(app):
                 CallbackQueryHandler(add_file, pattern="^add_file$"),
             ],
             MANUAL_INPUT: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, save_manual_post),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, consumes_update(save_manual_post)),
                 CommandHandler("done", done_manual),
                 CallbackQueryHandler(done_manual_button, pattern="^done_manual$"),
             ],
@@ -226,6 +269,8 @@ def setup_addposts_handlers(app):
         },
         fallbacks=[CommandHandler("start", lambda u, c: None)],
         allow_reentry=True,
+        name="addposts",
+        persistent=PERSISTENCE_ENABLED,
     )
 
     app.add_handler(conv_handler, group=0)
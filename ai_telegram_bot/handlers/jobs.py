@@ -0,0 +1,26 @@
+from telegram import Update
+from telegram.ext import ContextTypes, CallbackQueryHandler
+from telegram.error import BadRequest
+from services import jobs, metrics
+
+
+@metrics.handler
+async def cancel_job(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    job_id = int(query.data.removeprefix("cancel_job_"))
+
+    status = await jobs.cancel(job_id, query.message.chat_id)
+    if status is None:
+        await query.answer("Задача уже завершена")
+        return
+
+    await query.answer("Отменяю...")
+    if status == "cancelled":
+        try:
+            await query.message.edit_text("🚫 Задача отменена.")
+        except BadRequest:
+            pass
+
+
+def setup_job_handlers(app):
+    app.add_handler(CallbackQueryHandler(cancel_job, pattern=r"^cancel_job_\d+$"))
@@ -1,3 +1,6 @@
+import asyncio
+import logging
+import time
 from telegram import (
     Update,
     InlineKeyboardButton,
@@ -11,40 +14,159 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
+from telegram.error import BadRequest, RetryAfter
 from services import database as db
-from services.llm import generate_post_ideas, generate_post_draft
+from services import suggestions, retrieval, metrics, event_log
+from services.llm import generate_post_draft, stream_post_draft, LLMError, DispatchPriority, PRIORITY_BACKGROUND
+from services.cache import TTLCache, MISSING
 from handlers import addposts
+from handlers.routing import consumes_update
+from config import (
+    DRAFT_EDIT_INTERVAL,
+    SPECULATIVE_DRAFTS,
+    SPECULATIVE_DRAFTS_TTL,
+    SPECULATIVE_DRAFTS_MAX_USERS,
+    PERSISTENCE_ENABLED,
+)
+
+logger = logging.getLogger(__name__)
 
 CHOOSING_IDEA, CHOOSING_STYLE, CONFIRM_DRAFT = range(3)
 
+# Черновики, запущенные заранее для всех стилей выбранной идеи:
+# {telegram_id: {"idea": str, "tasks": {style: asyncio.Task}, "priorities": {style: DispatchPriority}}}.
+# Задачи не сериализуются, поэтому живут вне context.user_data. TTL и размер кэша ограничивают
+# память, если пользователь бросил диалог на середине.
+_speculative_drafts = TTLCache(SPECULATIVE_DRAFTS_MAX_USERS, SPECULATIVE_DRAFTS_TTL, "speculative_drafts")
+
+
+# -------------------------
+# Спекулятивные черновики
+# -------------------------
+def start_speculative_drafts(user_id: int, channel: dict, idea: str, styles: list[str]):
+    """
+    Сразу после выбора идеи параллельно генерирует черновики для всех предложенных стилей,
+    чтобы к моменту нажатия на стиль черновик уже был готов.
+    """
+    drop_speculative_drafts(user_id)
+    # Похожие посты одни и те же для всех стилей — подбираем один раз
+    posts_task = asyncio.create_task(retrieval.posts_for_draft(channel["channel_id"], idea))
+    posts_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    # Приоритет выбранного стиля повышается в take_speculative_draft(), даже если запрос уже ждёт слот
+    priorities = {style: DispatchPriority(PRIORITY_BACKGROUND) for style in styles}
+
+    async def generate(style: str) -> str:
+        posts = await asyncio.shield(posts_task)
+        return await generate_post_draft(channel["name"], idea, style, posts, user_id, priorities[style])
+
+    tasks = {}
+    for style in styles:
+        task = asyncio.create_task(generate(style))
+        # Забираем исключение, чтобы отброшенные черновики не шумели в логах
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        tasks[style] = task
+
+    _speculative_drafts.set(user_id, {"idea": idea, "tasks": tasks, "priorities": priorities})
+
+
+def take_speculative_draft(user_id: int, idea: str, style: str):
+    """
+    Возвращает задачу с черновиком для выбранного стиля (или None).
+    Теперь его ждёт пользователь, поэтому запрос становится интерактивным.
+    Ещё не готовые черновики других стилей отменяются, готовые остаются
+    на случай возврата через back_to_styles.
+    """
+    entry = _speculative_drafts.get(user_id)
+    if entry is MISSING or entry["idea"] != idea:
+        return None
+
+    for other_style, task in entry["tasks"].items():
+        if other_style != style and not task.done():
+            task.cancel()
+
+    task = entry["tasks"].get(style)
+    if task is None or task.cancelled():
+        return None
+    if not task.done():
+        entry["priorities"][style].promote()
+    if task.done() and task.exception() is not None:
+        return None
+    return task
+
+
+def discard_speculative_draft(user_id: int, style: str):
+    """
+    Забывает заготовленный черновик одного стиля (после «Перегенерировать» он устарел).
+    """
+    entry = _speculative_drafts.get(user_id)
+    if entry is not MISSING:
+        task = entry["tasks"].pop(style, None)
+        if task is not None:
+            task.cancel()
+
+
+def drop_speculative_drafts(user_id: int):
+    entry = _speculative_drafts.get(user_id)
+    _speculative_drafts.invalidate(user_id)
+    if entry is not MISSING:
+        for task in entry["tasks"].values():
+            task.cancel()
+
+
+def _log_event(context: ContextTypes.DEFAULT_TYPE, event_type: str, post_id: int | None = None):
+    channel = context.user_data.get("selected_channel")
+    event_log.log_event(channel["user_id"] if isinstance(channel, dict) else None, event_type, post_id)
+
 
+@metrics.handler
 async def newpost_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.callback_query:
+        query = update.callback_query
+        await query.answer()
+        message = query.message
+    else:
+        message = update.message
+
     if "selected_channel" not in context.user_data:
-        await update.message.reply_text("⚠️ Сначала выберите канал в главном меню")
+        await message.reply_text("⚠️ Сначала выберите канал в главном меню")
         return ConversationHandler.END
 
     channel = context.user_data["selected_channel"]
     if isinstance(channel, dict):
         channel_id, channel_name = channel["channel_id"], channel["name"]
     else:
-        channels = db.get_channels_by_name(str(channel))
+        channels = await db.get_channels_by_name(str(channel))
         if not channels:
-            await update.message.reply_text("❌ Канал не найден")
+            await message.reply_text("❌ Канал не найден")
             return ConversationHandler.END
         channel_id, channel_name = channels[0]["channel_id"], channels[0]["name"]
         context.user_data["selected_channel"] = channels[0]
 
-    posts = db.get_last_posts(channel_id, limit=5)
+    posts = await db.get_last_posts(channel_id, limit=5)
     if len(posts) < 3:
-        await update.message.reply_text(
+        await message.reply_text(
             f"⚠️ В этом канале недостаточно примеров (найдено {len(posts)}).\n"
             "Для генерации идей нужно минимум 3 поста.\n"
             "Нажмите /addposts, чтобы сразу добавить посты."
         )
         return ConversationHandler.END
 
-    ideas = await generate_post_ideas([p["text"] for p in posts])
+    drop_speculative_drafts(update.effective_user.id)
+    try:
+        ideas = await suggestions.get_post_ideas(channel_id, [p["text"] for p in posts], update.effective_user.id)
+    except LLMError:
+        logger.exception("Failed to generate ideas for channel %s", channel_id)
+        _log_event(context, "ideas_failed")
+        keyboard = [[InlineKeyboardButton("🔁 Повторить", callback_data="retry_ideas")]]
+        await message.reply_text(
+            "⚠️ Не получилось придумать идеи: сервис генерации сейчас не отвечает.\n"
+            "Попробуйте ещё раз чуть позже.",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+        )
+        return ConversationHandler.END
     context.user_data["post_ideas"] = ideas
+    _log_event(context, "ideas_shown")
 
     keyboard = [
         [InlineKeyboardButton(f"{i+1}. {idea['idea']}", callback_data=f"idea_{i}")]
@@ -53,13 +175,14 @@ async def newpost_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard.append([InlineKeyboardButton("✏ Ввести свою тему", callback_data="custom")])
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await update.message.reply_text(
+    await message.reply_text(
         f"Выберите идею для нового поста в канале '{channel_name}':",
         reply_markup=reply_markup,
     )
     return CHOOSING_IDEA
 
 
+@metrics.handler
 async def choose_idea(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -68,16 +191,24 @@ async def choose_idea(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data == "custom":
         await query.message.reply_text("✏ Введите свою тему для поста:")
         context.user_data["custom_idea"] = True
+        _log_event(context, "custom_idea_requested")
         return CHOOSING_IDEA
 
     idx = int(data.replace("idea_", ""))
     selected = context.user_data["post_ideas"][idx]
     context.user_data["selected_idea"] = selected["idea"]
     context.user_data["available_styles"] = selected["styles"]
+    _log_event(context, "idea_chosen")
+
+    if SPECULATIVE_DRAFTS and isinstance(context.user_data.get("selected_channel"), dict):
+        start_speculative_drafts(
+            update.effective_user.id, context.user_data["selected_channel"], selected["idea"], selected["styles"]
+        )
 
     return await show_styles(query, context)
 
 
+@metrics.handler
 async def custom_idea_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.user_data.get("custom_idea"):
         return ConversationHandler.END
@@ -89,6 +220,13 @@ async def custom_idea_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     context.user_data["selected_idea"] = text
     context.user_data["available_styles"] = ["Юмористический", "Серьёзный", "Информационный"]
+    _log_event(context, "custom_idea_entered")
+
+    if SPECULATIVE_DRAFTS and isinstance(context.user_data.get("selected_channel"), dict):
+        start_speculative_drafts(
+            update.effective_user.id, context.user_data["selected_channel"], text, context.user_data["available_styles"]
+        )
+
     return await show_styles(update, context)
 
 
@@ -108,6 +246,7 @@ async def show_styles(update_or_query, context):
     return CHOOSING_STYLE
 
 
+@metrics.handler
 async def back_to_ideas(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -124,17 +263,21 @@ async def back_to_ideas(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CHOOSING_IDEA
 
 
+@metrics.handler
 async def choose_style(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    style = query.data.replace("style_", "")
+
+    # «Перегенерировать» — тот же стиль, но мимо кэша и заготовленных черновиков
+    regenerate = query.data == "regenerate_draft"
+    style = context.user_data["selected_style"] if regenerate else query.data.replace("style_", "")
     context.user_data["selected_style"] = style
 
     channel = context.user_data.get("selected_channel")
     if isinstance(channel, dict):
         channel_id, channel_name = channel["channel_id"], channel["name"]
     else:
-        channels = db.get_channels_by_name(str(channel))
+        channels = await db.get_channels_by_name(str(channel))
         if not channels:
             await query.message.reply_text("❌ Канал не найден")
             return ConversationHandler.END
@@ -142,26 +285,107 @@ async def choose_style(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data["selected_channel"] = channels[0]
 
     idea = context.user_data["selected_idea"]
-    posts = db.get_last_posts(channel_id, limit=5)
-    draft = await generate_post_draft(channel_name, idea, style, [p["text"] for p in posts])
+    placeholder = await query.message.reply_text("✍ Пишу черновик...")
+
+    draft = None
+    if regenerate:
+        discard_speculative_draft(update.effective_user.id, style)
+    speculative = None if regenerate else take_speculative_draft(update.effective_user.id, idea, style)
+    if speculative is not None:
+        await asyncio.wait({speculative})
+        if not speculative.cancelled() and speculative.exception() is None:
+            draft = speculative.result()
+
+    if draft is None:
+        posts = await retrieval.posts_for_draft(channel_id, idea)
+        try:
+            draft = await stream_draft_to_message(
+                placeholder,
+                stream_post_draft(
+                    channel_name, idea, style, posts,
+                    update.effective_user.id, use_cache=not regenerate,
+                ),
+            )
+        except LLMError:
+            logger.exception("Failed to generate draft for channel %s", channel_id)
+            _log_event(context, "draft_failed")
+            keyboard = [
+                [InlineKeyboardButton("🔁 Повторить", callback_data=f"style_{style}")],
+                [InlineKeyboardButton("⬅ Назад", callback_data="back_to_ideas")],
+            ]
+            await placeholder.edit_text(
+                "⚠️ Не получилось написать черновик: сервис генерации сейчас не отвечает.\n"
+                "Попробуйте ещё раз чуть позже.",
+                reply_markup=InlineKeyboardMarkup(keyboard),
+            )
+            return CHOOSING_STYLE
     context.user_data["draft_post"] = draft
+    _log_event(context, "draft_regenerated" if regenerate else "draft_generated")
 
     keyboard = [
         [InlineKeyboardButton("✅ Подтвердить", callback_data="confirm_draft")],
+        [InlineKeyboardButton("🔄 Перегенерировать", callback_data="regenerate_draft")],
         [InlineKeyboardButton("⬅ Назад", callback_data="back_to_styles")],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await query.message.reply_text(f"✅ Черновик готов!\n\n{draft}", reply_markup=reply_markup)
+    await _edit_waiting_flood(placeholder, f"✅ Черновик готов!\n\n{draft}", reply_markup=reply_markup)
     return CONFIRM_DRAFT
 
 
+async def stream_draft_to_message(message, deltas) -> str:
+    """
+    Собирает черновик из потока и по ходу правит сообщение-заглушку.
+    Первый текст показывается сразу, дальше правки идут не чаще DRAFT_EDIT_INTERVAL,
+    чтобы не упереться в лимиты Telegram. Если Telegram всё же ответил RetryAfter,
+    промежуточные правки пропускаются до конца паузы — поток при этом не прерывается.
+    """
+    started = time.monotonic()
+    next_edit = None
+    shown = ""
+    text = ""
+
+    async for delta in deltas:
+        if not text:
+            logger.info("Draft time-to-first-token: %.3fs", time.monotonic() - started)
+        text += delta
+
+        now = time.monotonic()
+        if (next_edit is None or now >= next_edit) and text.strip() != shown:
+            next_edit = now + DRAFT_EDIT_INTERVAL
+            try:
+                await message.edit_text(f"✍ Пишу черновик...\n\n{text.strip()}")
+            except BadRequest:
+                pass
+            except RetryAfter as e:
+                logger.info("Draft edits throttled by Telegram for %ss", e.retry_after)
+                next_edit = now + e.retry_after
+                continue
+            shown = text.strip()
+
+    return text.strip()
+
+
+async def _edit_waiting_flood(message, text: str, **kwargs):
+    """
+    Итоговая правка сообщения: её нельзя пропустить, поэтому при RetryAfter
+    выжидаем паузу, которую назвал Telegram, и пробуем ещё раз.
+    """
+    try:
+        await message.edit_text(text, **kwargs)
+    except RetryAfter as e:
+        await asyncio.sleep(e.retry_after)
+        await message.edit_text(text, **kwargs)
+
+
+@metrics.handler
 async def back_to_styles(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     return await show_styles(query, context)
 
 
+@metrics.handler
 async def confirm_draft(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -170,17 +394,24 @@ async def confirm_draft(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if isinstance(channel, dict):
         channel_id = channel["channel_id"]
     else:
-        channel_id = db.get_channels_by_name(str(channel))[0]["channel_id"]
+        channel_id = (await db.get_channels_by_name(str(channel)))[0]["channel_id"]
 
     idea = context.user_data["selected_idea"]
     style = context.user_data["selected_style"]
     draft = context.user_data["draft_post"]
 
-    db.add_post(channel_id, idea, style, draft)
-    await query.message.reply_text("💾 Черновик успешно сохранён!")
+    post, created = await db.add_post(channel_id, idea, style, draft)
+    _log_event(context, "draft_confirmed", post["post_id"])
+    drop_speculative_drafts(update.effective_user.id)
+    if created:
+        suggestions.schedule_refresh(channel_id)
+        await query.message.reply_text("💾 Черновик успешно сохранён!")
+    else:
+        await query.message.reply_text("♻ Такой пост в канале уже есть, повтор не сохранён.")
 
     return ConversationHandler.END
 
+@metrics.handler
 async def addposts_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -189,12 +420,15 @@ async def addposts_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 def setup_newpost_handlers(app):
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("newpost", newpost_command)],
+        entry_points=[
+            CommandHandler("newpost", newpost_command),
+            CallbackQueryHandler(newpost_command, pattern="^retry_ideas$"),
+        ],
         states={
             CHOOSING_IDEA: [
                 CallbackQueryHandler(choose_idea, pattern="^idea_"),
                 CallbackQueryHandler(choose_idea, pattern="^custom$"),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, custom_idea_input),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, consumes_update(custom_idea_input)),
             ],
             CHOOSING_STYLE: [
                 CallbackQueryHandler(choose_style, pattern="^style_"),
@@ -202,10 +436,13 @@ def setup_newpost_handlers(app):
             ],
             CONFIRM_DRAFT: [
                 CallbackQueryHandler(confirm_draft, pattern="^confirm_draft$"),
+                CallbackQueryHandler(choose_style, pattern="^regenerate_draft$"),
                 CallbackQueryHandler(back_to_styles, pattern="^back_to_styles$"),
             ],
         },
         fallbacks=[CommandHandler("start", lambda u, c: None)],
         allow_reentry=True,
+        name="newpost",
+        persistent=PERSISTENCE_ENABLED,
     )
     app.add_handler(conv_handler)
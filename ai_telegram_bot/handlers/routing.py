@@ -0,0 +1,19 @@
+import functools
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+
+
+def consumes_update(callback):
+    """
+    Оборачивает обработчик состояния ConversationHandler так, чтобы обработанный им апдейт
+    не уходил дальше в другие группы (например, в text_parser из группы 1).
+    Возвращённое состояние передаётся диалогу через ApplicationHandlerStop.
+    Если обработчик вернул END (апдейт ему не предназначался), диалог завершается,
+    а апдейт идёт дальше, как обычно.
+    """
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        state = await callback(update, context)
+        if state == ConversationHandler.END:
+            return state
+        raise ApplicationHandlerStop(state)
+    return wrapper
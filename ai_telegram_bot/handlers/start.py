@@ -1,6 +1,9 @@
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
 from services import database as db
+from services import metrics, event_log, jobs
+from handlers.newpost import drop_speculative_drafts
+from config import CHANNEL_PURGE_BATCH_SIZE
 
 
 def main_menu_reply():
@@ -15,15 +18,18 @@ def main_menu_reply():
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
 
+@metrics.handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
-    db_user = db.get_user(user.id)
+    db_user = await db.get_user(user.id)
 
     context.user_data.clear()
+    drop_speculative_drafts(user.id)
 
     if not db_user:
-        db.add_user(user.id, user.username)
+        db_user = await db.add_user(user.id, user.username)
+        event_log.log_event(db_user["user_id"], "user_registered")
 
         await update.message.reply_text(
             f"👋 Привет, {user.username}!\n\n"
@@ -49,6 +55,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+@metrics.handler
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "ℹ️ *Справка по командам*\n\n"
@@ -64,6 +71,7 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@metrics.handler
 async def add_channel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["awaiting_channel_name"] = True
 
@@ -76,10 +84,11 @@ async def add_channel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@metrics.handler
 async def delete_channel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    db_user = db.get_user(user.id)
-    channels = db.get_channels(db_user["user_id"])
+    db_user = await db.get_user(user.id)
+    channels = await db.get_channels(db_user["user_id"])
 
     if not channels:
         await update.message.reply_text(
@@ -100,10 +109,11 @@ async def delete_channel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
 
 
+@metrics.handler
 async def choose_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    db_user = db.get_user(user.id)
-    channels = db.get_channels(db_user["user_id"])
+    db_user = await db.get_user(user.id)
+    channels = await db.get_channels(db_user["user_id"])
 
     if not channels:
         await update.message.reply_text(
@@ -125,70 +135,117 @@ async def choose_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@metrics.handler
 async def back_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
+    drop_speculative_drafts(update.effective_user.id)
     await update.message.reply_text("↩ Возврат в главное меню", reply_markup=main_menu_reply())
 
 
-async def text_parser(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    db_user = db.get_user(user.id)
-    text = update.message.text.strip()
+async def _on_channel_name(update: Update, context: ContextTypes.DEFAULT_TYPE, db_user: dict, text: str):
+    await db.add_channel(db_user["user_id"], text)
+    event_log.log_event(db_user["user_id"], "channel_added")
+    context.user_data["awaiting_channel_name"] = False
+    await update.message.reply_text(
+        f"✅ Канал '{text}' добавлен!\n\n"
+        "Теперь вы можете:\n"
+        "• /choose_channel — выбрать этот канал для работы и создавать посты\n"
+        "• /add_channel — добавить ещё один канал, если хотите разделять темы\n\n"
+        "💡 После выбора канала используйте /newpost, чтобы я предложил идеи и помог написать пост в стиле этого канала.",
+        reply_markup=main_menu_reply()
+    )
 
-    if context.user_data.get("awaiting_channel_name"):
-        db.add_channel(db_user["user_id"], text)
-        context.user_data["awaiting_channel_name"] = False
-        await update.message.reply_text(
-            f"✅ Канал '{text}' добавлен!\n\n"
-            "Теперь вы можете:\n"
-            "• /choose_channel — выбрать этот канал для работы и создавать посты\n"
-            "• /add_channel — добавить ещё один канал, если хотите разделять темы\n\n"
-            "💡 После выбора канала используйте /newpost, чтобы я предложил идеи и помог написать пост в стиле этого канала.",
-            reply_markup=main_menu_reply()
-        )
 
+async def _on_channel_deletion(update: Update, context: ContextTypes.DEFAULT_TYPE, db_user: dict, text: str):
+    channel = await db.get_user_channel(db_user["user_id"], text)
+    if not channel:
+        await update.message.reply_text("❌ Канал не найден, попробуйте снова.")
         return
 
-    if context.user_data.get("awaiting_channel_deletion"):
-        channels = db.get_channels(db_user["user_id"])
-        channel = next((ch for ch in channels if ch["name"] == text), None)
-        if not channel:
-            await update.message.reply_text("❌ Канал не найден, попробуйте снова.")
-            return
+    # Канал только помечается удалённым, посты стирает фоновая задача — отвечаем сразу
+    channel_ids = await db.delete_channel(db_user["user_id"], channel["name"])
+    for channel_id in channel_ids:
+        await jobs.enqueue("purge_channel", {"channel_id": channel_id})
+    event_log.log_event(db_user["user_id"], "channel_deleted")
+    context.user_data["awaiting_channel_deletion"] = False
+    selected = context.user_data.get("selected_channel")
+    if selected and selected["channel_id"] in channel_ids:
+        context.user_data.pop("selected_channel")
 
-        db.delete_channel(db_user["user_id"], channel["name"])
-        context.user_data["awaiting_channel_deletion"] = False
+    await update.message.reply_text(
+        f"🗑 Канал '{text}' удалён!",
+        reply_markup=main_menu_reply()
+    )
 
-        await update.message.reply_text(
-            f"🗑 Канал '{text}' удалён!",
-            reply_markup=main_menu_reply()
-        )
+
+@jobs.job_handler("purge_channel")
+async def purge_channel_job(job: jobs.Job):
+    channel_id = job.payload["channel_id"]
+    deleted = 0
+    while purged := await db.purge_channel_posts(channel_id, CHANNEL_PURGE_BATCH_SIZE):
+        deleted += purged
+        # Обновляет heartbeat задачи, чтобы долгую очистку не сочли брошенной
+        await job.progress(deleted, f"🗑 Удалено постов: {deleted}...")
+    await db.drop_channel(channel_id)
+    return {"deleted_posts": deleted}
+
+
+async def resume_channel_purges():
+    """
+    Ставит очистку каналов, которые помечены удалёнными, но задачи на них нет
+    (например, процесс упал между пометкой и постановкой). Вызывается при старте.
+    """
+    for channel_id in await db.get_channels_pending_purge("purge_channel"):
+        await jobs.enqueue("purge_channel", {"channel_id": channel_id})
+
+
+async def _on_channel_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, db_user: dict, text: str):
+    channel = await db.get_user_channel(db_user["user_id"], text)
+    if not channel:
+        await update.message.reply_text("❌ Канал не найден, попробуйте снова.")
         return
 
-    if context.user_data.get("awaiting_channel_selection"):
-        channels = db.get_channels(db_user["user_id"])
-        channel = next((ch for ch in channels if ch["name"] == text), None)
-        if not channel:
-            await update.message.reply_text("❌ Канал не найден, попробуйте снова.")
-            return
+    context.user_data["selected_channel"] = channel
+    context.user_data["awaiting_channel_selection"] = False
+    event_log.log_event(db_user["user_id"], "channel_selected")
 
-        context.user_data["selected_channel"] = channel
-        context.user_data["awaiting_channel_selection"] = False
+    keyboard = [
+        [KeyboardButton("/newpost"), KeyboardButton("/addposts")],
+        [KeyboardButton("/back")]
+    ]
 
-        keyboard = [
-            [KeyboardButton("/newpost"), KeyboardButton("/addposts")],
-            [KeyboardButton("/back")]
-        ]
+    await update.message.reply_text(
+        f"✅ Выбран канал *{text}*.\nТеперь вы можете использовать /newpost или /addposts из меню.",
+        reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True),
+        parse_mode="Markdown"
+    )
 
-        await update.message.reply_text(
-            f"✅ Выбран канал *{text}*.\nТеперь вы можете использовать /newpost или /addposts из меню.",
-            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True),
-            parse_mode="Markdown"
-        )
 
+# Флаг ожидания в user_data -> обработчик ввода (проверяются по порядку)
+TEXT_STATES = [
+    ("awaiting_channel_name", _on_channel_name),
+    ("awaiting_channel_deletion", _on_channel_deletion),
+    ("awaiting_channel_selection", _on_channel_selection),
+]
+
+
+@metrics.handler
+async def text_parser(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Разбирает свободный текст по состоянию ожидания из user_data.
+    Без активного состояния в БД не ходим — просто подсказываем про кнопки.
+    """
+    handler = next((h for flag, h in TEXT_STATES if context.user_data.get(flag)), None)
+    if handler is None:
+        await update.message.reply_text("❗ Пожалуйста, используйте кнопки или команды для взаимодействия.")
+        return
+
+    db_user = await db.get_user(update.effective_user.id)
+    if not db_user:
+        await update.message.reply_text("⚠️ Сначала нажмите /start")
         return
 
-    await update.message.reply_text("❗ Пожалуйста, используйте кнопки или команды для взаимодействия.")
+    await handler(update, context, db_user, update.message.text.strip())
 
 
 def setup_start_handlers(app):
@@ -0,0 +1,76 @@
+# services/cache.py
+
+import time
+from collections import OrderedDict
+from services import metrics
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Простой in-process кэш с ограничением по размеру (LRU) и времени жизни записей.
+    Считает попадания и промахи, чтобы было видно, сколько запросов он экономит.
+    Если заданы weigh(value) и max_weight, кэш ограничен ещё и суммарным весом записей
+    (например, байтами), а не только их количеством.
+    """
+
+    def __init__(self, max_size: int, ttl: float, name: str = "cache", max_weight: int | None = None, weigh=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._hit_metric = metrics.CACHE_EVENTS.labels(name, "hit")
+        self._miss_metric = metrics.CACHE_EVENTS.labels(name, "miss")
+
+    def get(self, key, default=MISSING):
+        item = self._data.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                self._hit_metric.inc()
+                return value
+            self._pop(key)
+
+        self.misses += 1
+        self._miss_metric.inc()
+        return default
+
+    def set(self, key, value):
+        self._pop(key)
+        if self.weigh is not None:
+            weight = self.weigh(value)
+            # Запись тяжелее всего кэша не храним, чтобы не вытеснять ради неё остальные
+            if self.max_weight is not None and weight > self.max_weight:
+                return
+            self.weight += weight
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        while len(self._data) > self.max_size or (self.max_weight is not None and self.weight > self.max_weight):
+            self._pop(next(iter(self._data)))
+
+    def invalidate(self, key):
+        self._pop(key)
+
+    def clear(self):
+        self._data.clear()
+        self.weight = 0
+
+    def _pop(self, key):
+        item = self._data.pop(key, None)
+        if item is not None and self.weigh is not None:
+            self.weight -= self.weigh(item[1])
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        stats = {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+        if self.weigh is not None:
+            stats["weight"] = self.weight
+        return stats
@@ -0,0 +1,97 @@
+# services/completion_cache.py
+
+import asyncio
+import logging
+from services import database as db
+from services import metrics
+from services.cache import TTLCache, MISSING
+from config import LLM_CACHE_TTL, LLM_CACHE_MEMORY_SIZE, LLM_CACHE_MAX_ROWS
+
+logger = logging.getLogger(__name__)
+
+# Раз в сколько сохранений чистить таблицу от старых записей
+PRUNE_EVERY = 200
+
+_memory = TTLCache(LLM_CACHE_MEMORY_SIZE, LLM_CACHE_TTL, "llm_memory")
+_stats = {
+    "memory_hits": 0,
+    "db_hits": 0,
+    "misses": 0,
+    "saved_prompt_tokens": 0,
+    "saved_completion_tokens": 0,
+}
+_saves = 0
+_prune_task: asyncio.Task | None = None
+
+
+async def get(key: str) -> str | None:
+    """
+    Ищет готовый ответ сначала в памяти, затем в Postgres.
+    Ошибки БД не мешают генерации — в этом случае считаем, что ответа нет.
+    """
+    entry = _memory.get(key)
+    if entry is not MISSING:
+        _stats["memory_hits"] += 1
+        return _hit(entry)
+
+    if db.pool is not None:
+        try:
+            entry = await db.get_completion(key, LLM_CACHE_TTL)
+        except Exception:
+            logger.exception("Failed to read LLM cache")
+            entry = None
+
+        if entry is not None:
+            _memory.set(key, entry)
+            _stats["db_hits"] += 1
+            metrics.CACHE_EVENTS.labels("llm_db", "hit").inc()
+            return _hit(entry)
+        metrics.CACHE_EVENTS.labels("llm_db", "miss").inc()
+
+    _stats["misses"] += 1
+    return None
+
+
+async def put(key: str, response: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+    global _saves, _prune_task
+
+    entry = {
+        "response": response,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+    }
+    _memory.set(key, entry)
+
+    if db.pool is None:
+        return
+    try:
+        await db.save_completion(key, response, prompt_tokens, completion_tokens)
+    except Exception:
+        logger.exception("Failed to write LLM cache")
+        return
+
+    _saves += 1
+    if _saves % PRUNE_EVERY == 0 and (_prune_task is None or _prune_task.done()):
+        _prune_task = asyncio.create_task(_prune())
+
+
+async def _prune():
+    try:
+        await db.prune_completions(LLM_CACHE_TTL, LLM_CACHE_MAX_ROWS)
+    except Exception:
+        logger.exception("Failed to prune LLM cache")
+
+
+def _hit(entry: dict) -> str:
+    _stats["saved_prompt_tokens"] += entry["prompt_tokens"] or 0
+    _stats["saved_completion_tokens"] += entry["completion_tokens"] or 0
+    return entry["response"]
+
+
+def stats() -> dict:
+    """
+    Доля попаданий и сколько токенов удалось не тратить благодаря кэшу.
+    """
+    hits = _stats["memory_hits"] + _stats["db_hits"]
+    total = hits + _stats["misses"]
+    return {**_stats, "hit_rate": hits / total if total else 0.0}
@@ -1,220 +1,780 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+import json
+from itertools import islice
+import asyncpg
+from config import (
+    DB_HOST,
+    DB_PORT,
+    DB_NAME,
+    DB_USER,
+    DB_PASSWORD,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_CACHE_MAX_SIZE,
+    DB_CACHE_TTL,
+    IMPORT_CHUNK_SIZE,
+)
+from services import migrations, metrics, embeddings, dedup
+from services.executor import run_blocking
+from services.cache import TTLCache, MISSING
 
-conn = None
+pool = None
 
-def init_db():
-    global conn
-    conn = psycopg2.connect(
+# Кэши горячих запросов: пользователь по telegram_id, каналы по user_id и по имени
+_users_cache = TTLCache(DB_CACHE_MAX_SIZE, DB_CACHE_TTL, "users")
+_channels_cache = TTLCache(DB_CACHE_MAX_SIZE, DB_CACHE_TTL, "channels")
+_channels_by_name_cache = TTLCache(DB_CACHE_MAX_SIZE, DB_CACHE_TTL, "channels_by_name")
+# Индекс каналов пользователя: user_id -> {название: канал}
+_channel_index_cache = TTLCache(DB_CACHE_MAX_SIZE, DB_CACHE_TTL, "channel_index")
+# Справочники ideas/styles только пополняются, id записей не меняются — держим имя -> id в памяти
+NAMES_CACHE_TTL = 24 * 3600
+_idea_ids_cache = TTLCache(DB_CACHE_MAX_SIZE, NAMES_CACHE_TTL, "idea_ids")
+_style_ids_cache = TTLCache(DB_CACHE_MAX_SIZE, NAMES_CACHE_TTL, "style_ids")
+# таблица -> (колонка id, колонка имени, кэш)
+_DICTIONARIES = {
+    "ideas": ("idea_id", "title", _idea_ids_cache),
+    "styles": ("style_id", "name", _style_ids_cache),
+}
+
+
+def _row(record):
+    return dict(record) if record is not None else None
+
+
+def _rows(records):
+    return [dict(r) for r in records]
+
+
+async def init_db():
+    """
+    Создаёт пул соединений с Postgres и накатывает миграции схемы (services/migrations.py).
+    Вызывается один раз при старте бота (в том же event loop, что и Application).
+    """
+    global pool
+    if pool is not None:
+        return
+
+    pool = await asyncpg.create_pool(
         host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
+        port=int(DB_PORT),
+        database=DB_NAME,
         user=DB_USER,
-        password=DB_PASSWORD
-    )
-    cur = conn.cursor()
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        user_id SERIAL PRIMARY KEY,
-        username TEXT,
-        telegram_id BIGINT UNIQUE,
-        created_at TIMESTAMP DEFAULT NOW(),
-        last_active TIMESTAMP DEFAULT NOW()
-    );
-    CREATE TABLE IF NOT EXISTS channels (
-        channel_id SERIAL PRIMARY KEY,
-        user_id INT REFERENCES users(user_id),
-        name TEXT,
-        created_at TIMESTAMP DEFAULT NOW(),
-        status TEXT DEFAULT 'active'
-    );
-    CREATE TABLE IF NOT EXISTS ideas (
-        idea_id SERIAL PRIMARY KEY,
-        title TEXT UNIQUE
-    );
-    CREATE TABLE IF NOT EXISTS styles (
-        style_id SERIAL PRIMARY KEY,
-        name TEXT UNIQUE
-    );
-    CREATE TABLE IF NOT EXISTS posts (
-        post_id SERIAL PRIMARY KEY,
-        channel_id INT REFERENCES channels(channel_id),
-        idea_id INT REFERENCES ideas(idea_id),
-        style_id INT REFERENCES styles(style_id),
-        text TEXT,
-        published_at TIMESTAMP DEFAULT NOW()
-    );
-    CREATE TABLE IF NOT EXISTS logs (
-        log_id SERIAL PRIMARY KEY,
-        user_id INT REFERENCES users(user_id),
-        post_id INT REFERENCES posts(post_id),
-        event_type TEXT,
-        created_at TIMESTAMP DEFAULT NOW()
-    );
-    """)
-    conn.commit()
-    cur.close()
+        password=DB_PASSWORD,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+    )
+
+    await migrations.migrate(pool)
+
+
+async def close_db():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
+def cache_stats() -> dict:
+    return {
+        "users": _users_cache.stats(),
+        "channels": _channels_cache.stats(),
+        "channels_by_name": _channels_by_name_cache.stats(),
+        "channel_index": _channel_index_cache.stats(),
+        "idea_ids": _idea_ids_cache.stats(),
+        "style_ids": _style_ids_cache.stats(),
+    }
+
+
+def _invalidate_channels(user_id, name):
+    _channels_cache.invalidate(user_id)
+    _channel_index_cache.invalidate(user_id)
+    _channels_by_name_cache.invalidate(name)
 
 
 # -------------------------
 # Пользователи
 # -------------------------
-def add_user(telegram_id, username):
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT * FROM users WHERE telegram_id=%s", (telegram_id,))
-    user = cur.fetchone()
-    if not user:
-        cur.execute(
-            "INSERT INTO users (username, telegram_id) VALUES (%s, %s) RETURNING *",
-            (username, telegram_id)
-        )
-        user = cur.fetchone()
-        conn.commit()
-    cur.close()
+@metrics.db_query
+async def add_user(telegram_id, username):
+    async with pool.acquire() as conn:
+        user = await conn.fetchrow("SELECT * FROM users WHERE telegram_id=$1", telegram_id)
+        if not user:
+            user = await conn.fetchrow(
+                "INSERT INTO users (username, telegram_id) VALUES ($1, $2) RETURNING *",
+                username, telegram_id
+            )
+    user = _row(user)
+    _users_cache.set(telegram_id, user)
     return user
 
 
-def get_user(telegram_id):
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT * FROM users WHERE telegram_id=%s", (telegram_id,))
-    user = cur.fetchone()
-    cur.close()
+@metrics.db_query
+async def get_user(telegram_id):
+    user = _users_cache.get(telegram_id)
+    if user is MISSING:
+        user = _row(await pool.fetchrow("SELECT * FROM users WHERE telegram_id=$1", telegram_id))
+        _users_cache.set(telegram_id, user)
     return user
 
 
 # -------------------------
 # Каналы
 # -------------------------
-def add_channel(user_id, name):
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute(
-        "INSERT INTO channels (user_id, name) VALUES (%s, %s) RETURNING *",
-        (user_id, name)
+@metrics.db_query
+async def add_channel(user_id, name):
+    channel = await pool.fetchrow(
+        "INSERT INTO channels (user_id, name) VALUES ($1, $2) RETURNING *",
+        user_id, name
     )
-    channel = cur.fetchone()
-    conn.commit()
-    cur.close()
-    return channel
-
+    _invalidate_channels(user_id, name)
+    return _row(channel)
 
-def get_channels(user_id):
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT * FROM channels WHERE user_id=%s", (user_id,))
-    channels = cur.fetchall()
-    cur.close()
-    return channels
 
+@metrics.db_query
+async def get_channels(user_id):
+    channels = _channels_cache.get(user_id)
+    if channels is MISSING:
+        channels = _rows(await pool.fetch("SELECT * FROM channels WHERE user_id=$1 AND status IS DISTINCT FROM 'deleted'", user_id))
+        _channels_cache.set(user_id, channels)
+    return list(channels)
 
-def get_channels_by_name(name):
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT * FROM channels WHERE name=%s", (name,))
-    channels = cur.fetchall()
-    cur.close()
-    return channels
 
-def delete_channel(user_id: int, channel_name: str) -> bool:
+async def get_user_channel(user_id, name):
     """
-    Безопасно удаляет канал пользователя по имени.
-    Удаляет сначала связанные логи и посты, затем сам канал,
-    чтобы не нарушать FK-ограничения.
-    Возвращает True, если канал найден и удалён, False если канал не найден.
+    Канал пользователя по названию через индекс в памяти (без перебора списка каналов).
     """
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    index = _channel_index_cache.get(user_id)
+    if index is MISSING:
+        index = {}
+        for channel in await get_channels(user_id):
+            index.setdefault(channel["name"], channel)
+        _channel_index_cache.set(user_id, index)
+    return index.get(name)
 
-    cur.execute(
-        "SELECT channel_id FROM channels WHERE user_id = %s AND name = %s",
-        (user_id, channel_name),
-    )
-    row = cur.fetchone()
-    if not row:
-        cur.close()
-        return False
 
-    channel_id = row["channel_id"]
+@metrics.db_query
+async def get_channels_by_name(name):
+    channels = _channels_by_name_cache.get(name)
+    if channels is MISSING:
+        channels = _rows(await pool.fetch("SELECT * FROM channels WHERE name=$1 AND status IS DISTINCT FROM 'deleted'", name))
+        _channels_by_name_cache.set(name, channels)
+    return list(channels)
 
-    cur.execute(
+
+@metrics.db_query
+async def delete_channel(user_id: int, channel_name: str) -> list[int]:
+    """
+    Мягко удаляет канал пользователя по имени: помечает status = 'deleted', и канал сразу
+    пропадает из списков. Посты и логи потом стирает фоновая очистка (purge_channel_posts, drop_channel).
+    Возвращает channel_id помеченных каналов (пустой список, если канал не найден).
+    """
+    rows = await pool.fetch(
         """
-        DELETE FROM logs
-        WHERE post_id IN (
-            SELECT post_id FROM posts WHERE channel_id = %s
-        )
+        UPDATE channels SET status = 'deleted'
+        WHERE user_id = $1 AND name = $2 AND status IS DISTINCT FROM 'deleted'
+        RETURNING channel_id
         """,
-        (channel_id,),
+        user_id, channel_name,
     )
+    _invalidate_channels(user_id, channel_name)
+    return [r["channel_id"] for r in rows]
 
-    cur.execute(
-        "DELETE FROM posts WHERE channel_id = %s",
-        (channel_id,),
-    )
 
-    cur.execute(
-        "DELETE FROM channels WHERE channel_id = %s",
-        (channel_id,),
-    )
+@metrics.db_query
+async def purge_channel_posts(channel_id: int, batch_size: int) -> int:
+    """
+    Стирает пачку постов удалённого канала вместе с их логами — короткой транзакцией,
+    чтобы не держать долгих блокировок. Возвращает число удалённых постов (0 — постов не осталось).
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            post_ids = [
+                r["post_id"] for r in await conn.fetch(
+                    "SELECT post_id FROM posts WHERE channel_id = $1 LIMIT $2", channel_id, batch_size
+                )
+            ]
+            if not post_ids:
+                return 0
+            await conn.execute("DELETE FROM logs WHERE post_id = ANY($1::int[])", post_ids)
+            result = await conn.execute("DELETE FROM posts WHERE post_id = ANY($1::int[])", post_ids)
+    return int(result.split()[-1])
 
-    conn.commit()
-    cur.close()
+
+@metrics.db_query
+async def drop_channel(channel_id: int) -> bool:
+    """
+    Удаляет сам помеченный канал после purge_channel_posts. Посты, успевшие появиться
+    за время очистки, удаляются в той же транзакции, чтобы не нарушать FK-ограничения;
+    FOR UPDATE ждёт незавершённые вставки постов в канал (см. _lock_channel).
+    Возвращает False, если канала нет или он не помечен удалённым.
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            found = await conn.fetchval(
+                "SELECT 1 FROM channels WHERE channel_id = $1 AND status = 'deleted' FOR UPDATE", channel_id
+            )
+            if found is None:
+                return False
+
+            await conn.execute(
+                "DELETE FROM logs WHERE post_id IN (SELECT post_id FROM posts WHERE channel_id = $1)", channel_id
+            )
+            await conn.execute("DELETE FROM posts WHERE channel_id = $1", channel_id)
+            await conn.execute("DELETE FROM post_suggestions WHERE channel_id = $1", channel_id)
+            await conn.execute("DELETE FROM channels WHERE channel_id = $1", channel_id)
     return True
 
 
+@metrics.db_query
+async def get_channels_pending_purge(job_kind: str) -> list[int]:
+    """
+    Помеченные удалёнными каналы, для которых нет ни ждущей, ни выполняемой задачи очистки job_kind.
+    """
+    rows = await pool.fetch(
+        """
+        SELECT channel_id FROM channels c
+        WHERE status = 'deleted' AND NOT EXISTS (
+            SELECT 1 FROM jobs j
+            WHERE j.kind = $1 AND j.status IN ('queued', 'running')
+                AND j.payload->>'channel_id' = c.channel_id::text
+        )
+        """,
+        job_kind,
+    )
+    return [r["channel_id"] for r in rows]
+
+
 # -------------------------
 # Посты
 # -------------------------
-def add_post(channel_id: int, idea_title: str, style_name: str, text: str):
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+@metrics.db_query
+async def add_post(channel_id: int, idea_title: str, style_name: str, text: str) -> tuple[dict, bool]:
+    """
+    Сохраняет пост. id идеи и стиля обычно уже в кэше, и тогда это один INSERT.
+    Возвращает (пост, created): если такой текст в канале уже есть, это существующий пост и created=False.
+    """
+    idea_ids = await _resolve_names(pool, "ideas", {idea_title})
+    style_ids = await _resolve_names(pool, "styles", {style_name})
+    # Вне транзакции upsert уже закоммичен — id можно запоминать сразу
+    _remember_names("ideas", idea_ids)
+    _remember_names("styles", style_ids)
 
-    cur.execute("SELECT idea_id FROM ideas WHERE title=%s", (idea_title,))
-    idea = cur.fetchone()
-    if not idea:
-        cur.execute("INSERT INTO ideas (title) VALUES (%s) RETURNING idea_id", (idea_title,))
-        idea = cur.fetchone()
+    text_hash = dedup.text_hash(text)
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await _lock_channel(conn, channel_id)
+            post = await conn.fetchrow(
+                """
+                INSERT INTO posts (channel_id, idea_id, style_id, text, embedding, text_hash)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT (channel_id, text_hash) DO NOTHING
+                RETURNING *
+                """,
+                channel_id, idea_ids[idea_title], style_ids[style_name], text,
+                embeddings.to_bytes(embeddings.embed(text)), text_hash
+            )
+            created = post is not None
+            if not created:
+                post = await conn.fetchrow(
+                    "SELECT * FROM posts WHERE channel_id=$1 AND text_hash=$2", channel_id, text_hash
+                )
+    return _row(post), created
 
-    cur.execute("SELECT style_id FROM styles WHERE name=%s", (style_name,))
-    style = cur.fetchone()
-    if not style:
-        cur.execute("INSERT INTO styles (name) VALUES (%s) RETURNING style_id", (style_name,))
-        style = cur.fetchone()
 
-    cur.execute(
-        """
-        INSERT INTO posts (channel_id, idea_id, style_id, text)
-        VALUES (%s, %s, %s, %s)
-        RETURNING *
-        """,
-        (channel_id, idea["idea_id"], style["style_id"], text)
-    )
-    post = cur.fetchone()
-    conn.commit()
-    cur.close()
-    return post
+@metrics.db_query
+async def add_posts_bulk(channel_id: int, posts, chunk_size: int = IMPORT_CHUNK_SIZE, on_progress=None) -> int:
+    """
+    Массовая вставка постов: posts — итерируемое (обычное или асинхронное)
+    из кортежей (idea_title, style_name, text).
+    Идеи и стили разрешаются одним запросом на пачку, посты вставляются одним INSERT ... unnest
+    на пачку, всё в одной транзакции с одним коммитом.
+    Тексты, которые в канале уже есть (в том числе повторы внутри файла), пропускаются.
+    on_progress(saved) — необязательный корутинный колбэк после каждой пачки.
+    Возвращает количество сохранённых постов.
+    """
+    saved = 0
+    resolved = {"ideas": {}, "styles": {}}
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await _lock_channel(conn, channel_id)
+            async for chunk in _chunks(posts, chunk_size):
+                idea_ids = await _resolve_names(conn, "ideas", {c[0] for c in chunk})
+                style_ids = await _resolve_names(conn, "styles", {c[1] for c in chunk})
+                resolved["ideas"].update(idea_ids)
+                resolved["styles"].update(style_ids)
+                vectors = await run_blocking(embeddings.embed_many, [c[2] for c in chunk])
+
+                result = await conn.execute(
+                    """
+                    INSERT INTO posts (channel_id, idea_id, style_id, text, embedding, text_hash)
+                    SELECT $1, idea_id, style_id, text, embedding, text_hash
+                    FROM unnest($2::int[], $3::int[], $4::text[], $5::bytea[], $6::bytea[])
+                        AS p(idea_id, style_id, text, embedding, text_hash)
+                    ON CONFLICT (channel_id, text_hash) DO NOTHING
+                    """,
+                    channel_id,
+                    [idea_ids[c[0]] for c in chunk],
+                    [style_ids[c[1]] for c in chunk],
+                    [c[2] for c in chunk],
+                    [embeddings.to_bytes(vector) for vector in vectors],
+                    [dedup.text_hash(c[2]) for c in chunk],
+                )
+                saved += int(result.split()[-1])
 
+                if on_progress:
+                    await on_progress(saved)
 
-def get_last_posts(channel_id: int, limit=5):
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
+    # Только после коммита: при откате новых записей справочника в БД не будет
+    for table, ids in resolved.items():
+        _remember_names(table, ids)
+    return saved
+
+
+async def _lock_channel(conn, channel_id: int):
+    """
+    Блокирует строку канала до конца транзакции вставки постов. FOR KEY SHARE не мешает
+    delete_channel менять status, но drop_channel (FOR UPDATE) дождётся коммита вставки
+    и удалит её посты вместе с каналом — иначе DELETE канала падает на FK-ограничении.
+    """
+    await conn.execute("SELECT 1 FROM channels WHERE channel_id = $1 FOR KEY SHARE", channel_id)
+
+
+async def _chunks(posts, size: int):
+    if hasattr(posts, "__aiter__"):
+        chunk = []
+        async for post in posts:
+            chunk.append(post)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    else:
+        posts = iter(posts)
+        while chunk := list(islice(posts, size)):
+            yield chunk
+
+
+async def _resolve_names(conn, table: str, names: set) -> dict:
+    """
+    Возвращает {имя: id} для справочника ideas/styles: известные берёт из кэша,
+    остальные добавляет одним INSERT ... ON CONFLICT DO NOTHING и дочитывает id уже существующих.
+    DO UPDATE не используем: он блокирует существующие строки до конца транзакции, а в
+    add_posts_bulk это весь импорт. В кэш ничего не кладёт — это делает _remember_names() после коммита.
+    """
+    id_column, name_column, cache = _DICTIONARIES[table]
+    ids = {}
+    missing = []
+    for name in names:
+        cached = cache.get(name)
+        if cached is MISSING:
+            missing.append(name)
+        else:
+            ids[name] = cached
+
+    if missing:
+        rows = await conn.fetch(
+            f"""
+            INSERT INTO {table} ({name_column}) SELECT unnest($1::text[])
+            ON CONFLICT ({name_column}) DO NOTHING
+            RETURNING {id_column}, {name_column}
+            """,
+            missing,
+        )
+        ids.update({r[name_column]: r[id_column] for r in rows})
+
+        existing = [name for name in missing if name not in ids]
+        if existing:
+            rows = await conn.fetch(
+                f"SELECT {id_column}, {name_column} FROM {table} WHERE {name_column} = ANY($1::text[])",
+                existing,
+            )
+            ids.update({r[name_column]: r[id_column] for r in rows})
+    return ids
+
+
+def _remember_names(table: str, ids: dict):
+    cache = _DICTIONARIES[table][2]
+    for name, id_ in ids.items():
+        cache.set(name, id_)
+
+
+@metrics.db_query
+async def get_last_posts(channel_id: int, limit=5):
+    posts = await pool.fetch("""
         SELECT p.text, i.title AS idea, s.name AS style, p.published_at
         FROM posts p
         LEFT JOIN ideas i ON p.idea_id = i.idea_id
         LEFT JOIN styles s ON p.style_id = s.style_id
-        WHERE p.channel_id=%s
+        WHERE p.channel_id=$1
         ORDER BY p.published_at DESC, p.post_id DESC
-        LIMIT %s
-    """, (channel_id, limit))
-    posts = cur.fetchall()
-    cur.close()
-    return posts
+        LIMIT $2
+    """, channel_id, limit)
+    return _rows(posts)
+
+
+@metrics.db_query
+async def get_recent_post_texts(channel_id: int, limit: int) -> list[str]:
+    rows = await pool.fetch(
+        "SELECT text FROM posts WHERE channel_id=$1 ORDER BY post_id DESC LIMIT $2",
+        channel_id, limit
+    )
+    return [r["text"] for r in rows]
+
+
+@metrics.db_query
+async def get_post_embeddings(channel_id: int, after_post_id: int = 0):
+    """
+    Векторы постов канала с post_id больше after_post_id (для дозагрузки индекса), по возрастанию post_id.
+    """
+    rows = await pool.fetch(
+        """
+        SELECT post_id, embedding FROM posts
+        WHERE channel_id=$1 AND post_id > $2 AND embedding IS NOT NULL
+        ORDER BY post_id
+        """,
+        channel_id, after_post_id
+    )
+    return _rows(rows)
+
+
+@metrics.db_query
+async def get_posts_without_embeddings(channel_id: int, limit: int):
+    rows = await pool.fetch(
+        "SELECT post_id, text FROM posts WHERE channel_id=$1 AND embedding IS NULL LIMIT $2",
+        channel_id, limit
+    )
+    return _rows(rows)
+
+
+@metrics.db_query
+async def save_post_embeddings(items: list[tuple]):
+    """
+    items — (post_id, embedding).
+    """
+    await pool.executemany("UPDATE posts SET embedding=$2 WHERE post_id=$1", items)
+
+
+@metrics.db_query
+async def get_posts_texts(post_ids: list[int]) -> dict:
+    rows = await pool.fetch("SELECT post_id, text FROM posts WHERE post_id = ANY($1::int[])", post_ids)
+    return {r["post_id"]: r["text"] for r in rows}
+
+
+# -------------------------
+# Предложенные идеи
+# -------------------------
+@metrics.db_query
+async def get_suggestions(channel_id: int, fingerprint: str):
+    """
+    Возвращает сохранённые идеи канала, если они посчитаны по тем же постам (fingerprint).
+    """
+    ideas = await pool.fetchval(
+        "SELECT ideas FROM post_suggestions WHERE channel_id=$1 AND fingerprint=$2",
+        channel_id, fingerprint
+    )
+    return json.loads(ideas) if ideas is not None else None
+
+
+@metrics.db_query
+async def save_suggestions(channel_id: int, fingerprint: str, ideas: list[dict]):
+    await pool.execute(
+        """
+        INSERT INTO post_suggestions (channel_id, fingerprint, ideas)
+        VALUES ($1, $2, $3::jsonb)
+        ON CONFLICT (channel_id) DO UPDATE
+        SET fingerprint = EXCLUDED.fingerprint, ideas = EXCLUDED.ideas, updated_at = NOW()
+        """,
+        channel_id, fingerprint, json.dumps(ideas, ensure_ascii=False)
+    )
+
+
+# -------------------------
+# Кэш ответов LLM
+# -------------------------
+@metrics.db_query
+async def get_completion(key: str, ttl: int):
+    row = await pool.fetchrow(
+        """
+        UPDATE llm_cache SET hits = hits + 1, last_hit_at = NOW()
+        WHERE key = $1 AND created_at > NOW() - make_interval(secs => $2)
+        RETURNING response, prompt_tokens, completion_tokens
+        """,
+        key, ttl
+    )
+    return _row(row)
+
+
+@metrics.db_query
+async def save_completion(key: str, response: str, prompt_tokens: int, completion_tokens: int):
+    await pool.execute(
+        """
+        INSERT INTO llm_cache (key, response, prompt_tokens, completion_tokens)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (key) DO UPDATE
+        SET response = EXCLUDED.response,
+            prompt_tokens = EXCLUDED.prompt_tokens,
+            completion_tokens = EXCLUDED.completion_tokens,
+            created_at = NOW(),
+            last_hit_at = NOW()
+        """,
+        key, response, prompt_tokens, completion_tokens
+    )
+
+
+@metrics.db_query
+async def prune_completions(ttl: int, max_rows: int):
+    """
+    Удаляет просроченные ответы и самые давно не использованные сверх max_rows.
+    """
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "DELETE FROM llm_cache WHERE created_at <= NOW() - make_interval(secs => $1)", ttl
+        )
+        await conn.execute(
+            """
+            DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY last_hit_at DESC OFFSET $1
+            )
+            """,
+            max_rows
+        )
+
+
+# -------------------------
+# Состояние бота (persistence)
+# -------------------------
+@metrics.db_query
+async def load_persistence(kind: str) -> dict:
+    rows = await pool.fetch("SELECT key, data FROM bot_persistence WHERE kind=$1", kind)
+    return {r["key"]: r["data"] for r in rows}
+
+
+@metrics.db_query
+async def load_persistence_item(kind: str, key: str):
+    return await pool.fetchval("SELECT data FROM bot_persistence WHERE kind=$1 AND key=$2", kind, key)
+
+
+@metrics.db_query
+async def save_persistence(upserts: list[tuple], deletes: list[tuple]):
+    """
+    Одной транзакцией записывает пачку изменений: upserts — (kind, key, data), deletes — (kind, key).
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if upserts:
+                await conn.executemany(
+                    """
+                    INSERT INTO bot_persistence (kind, key, data) VALUES ($1, $2, $3)
+                    ON CONFLICT (kind, key) DO UPDATE SET data = EXCLUDED.data, updated_at = NOW()
+                    """,
+                    upserts
+                )
+            if deletes:
+                await conn.executemany(
+                    "DELETE FROM bot_persistence WHERE kind=$1 AND key=$2", deletes
+                )
+
+
+# -------------------------
+# Очередь апдейтов (режим BOT_MODE = "queue")
+# -------------------------
+UPDATE_QUEUE_CHANNEL = "update_queue"
+
+
+@metrics.db_query
+async def enqueue_update(shard: int, user_key: int, payload: str):
+    """
+    Кладёт апдейт (сырой JSON от Telegram) в очередь и будит воркер нужного шарда через NOTIFY.
+    """
+    await pool.execute(
+        """
+        WITH queued AS (
+            INSERT INTO update_queue (shard, user_key, payload) VALUES ($1, $2, $3::jsonb)
+            RETURNING shard
+        )
+        SELECT pg_notify($4, shard::text) FROM queued
+        """,
+        shard, user_key, payload, UPDATE_QUEUE_CHANNEL
+    )
+
+
+@metrics.db_query
+async def claim_updates(shard: int, limit: int):
+    """
+    Забирает до limit ещё не взятых апдейтов шарда в порядке поступления.
+    """
+    rows = await pool.fetch(
+        """
+        UPDATE update_queue SET claimed_at = NOW()
+        WHERE id IN (
+            SELECT id FROM update_queue
+            WHERE shard = $1 AND claimed_at IS NULL
+            ORDER BY id
+            LIMIT $2
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, user_key, payload
+        """,
+        shard, limit
+    )
+    return sorted(_rows(rows), key=lambda r: r["id"])
+
+
+@metrics.db_query
+async def ack_update(update_id: int):
+    await pool.execute("DELETE FROM update_queue WHERE id=$1", update_id)
+
+
+@metrics.db_query
+async def release_updates(shard: int):
+    """
+    Возвращает в очередь апдейты шарда, взятые прошлым владельцем, но не обработанные (он упал).
+    """
+    await pool.execute(
+        "UPDATE update_queue SET claimed_at = NULL WHERE shard=$1 AND claimed_at IS NOT NULL", shard
+    )
+
+
+# -------------------------
+# Фоновые задачи
+# -------------------------
+@metrics.db_query
+async def enqueue_job(kind: str, payload: dict, chat_id: int = None, message_id: int = None) -> int:
+    return await pool.fetchval(
+        """
+        INSERT INTO jobs (kind, payload, chat_id, message_id)
+        VALUES ($1, $2::jsonb, $3, $4)
+        RETURNING job_id
+        """,
+        kind, json.dumps(payload, ensure_ascii=False), chat_id, message_id
+    )
+
+
+@metrics.db_query
+async def claim_job():
+    """
+    Забирает самую старую задачу из очереди и помечает её выполняющейся.
+    Несколько воркеров (и процессов) не получат одну и ту же задачу благодаря SKIP LOCKED.
+    """
+    job = _row(await pool.fetchrow(
+        """
+        UPDATE jobs SET status = 'running', started_at = NOW(), heartbeat_at = NOW()
+        WHERE job_id = (
+            SELECT job_id FROM jobs WHERE status = 'queued'
+            ORDER BY job_id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING job_id, kind, payload, chat_id, message_id
+        """
+    ))
+    if job is not None:
+        job["payload"] = json.loads(job["payload"])
+    return job
+
+
+@metrics.db_query
+async def update_job_progress(job_id: int, progress: int) -> bool:
+    """
+    Записывает прогресс (заодно это heartbeat) и возвращает True, если задачу попросили отменить.
+    """
+    return bool(await pool.fetchval(
+        """
+        UPDATE jobs SET progress = $2, heartbeat_at = NOW()
+        WHERE job_id = $1
+        RETURNING cancel_requested
+        """,
+        job_id, progress
+    ))
+
+
+@metrics.db_query
+async def finish_job(job_id: int, status: str, result: dict = None, error: str = None):
+    await pool.execute(
+        """
+        UPDATE jobs SET status = $2, result = $3::jsonb, error = $4, finished_at = NOW()
+        WHERE job_id = $1
+        """,
+        job_id, status, json.dumps(result, ensure_ascii=False) if result is not None else None, error
+    )
+
+
+@metrics.db_query
+async def request_job_cancel(job_id: int, chat_id: int):
+    """
+    Просит отменить задачу этого чата. Ещё не начатая задача отменяется сразу,
+    выполняющаяся — при следующей проверке прогресса.
+    Возвращает новый статус задачи или None, если отменять уже нечего.
+    """
+    return await pool.fetchval(
+        """
+        UPDATE jobs SET
+            cancel_requested = TRUE,
+            status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+            finished_at = CASE WHEN status = 'queued' THEN NOW() ELSE finished_at END
+        WHERE job_id = $1 AND chat_id = $2 AND status IN ('queued', 'running')
+        RETURNING status
+        """,
+        job_id, chat_id
+    )
+
+
+@metrics.db_query
+async def requeue_job(job_id: int):
+    await pool.execute(
+        "UPDATE jobs SET status = 'queued', started_at = NULL WHERE job_id = $1 AND status = 'running'", job_id
+    )
+
+
+@metrics.db_query
+async def touch_jobs(job_ids: list[int]):
+    """
+    Продлевает heartbeat выполняемых задач, чтобы их не сочли брошенными.
+    """
+    await pool.execute(
+        "UPDATE jobs SET heartbeat_at = NOW() WHERE job_id = ANY($1::bigint[]) AND status = 'running'", job_ids
+    )
+
+
+@metrics.db_query
+async def requeue_stale_jobs(stale_after: int) -> int:
+    """
+    Возвращает в очередь задачи, чей воркер давно не подавал признаков жизни (процесс упал).
+    """
+    result = await pool.execute(
+        """
+        UPDATE jobs SET status = 'queued', started_at = NULL
+        WHERE status = 'running' AND heartbeat_at < NOW() - make_interval(secs => $1)
+        """,
+        stale_after
+    )
+    return int(result.split()[-1])
 
 
 # -------------------------
 # Логи
 # -------------------------
-def add_log(user_id, post_id, event_type):
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO logs (user_id, post_id, event_type) VALUES (%s, %s, %s)",
-        (user_id, post_id, event_type)
+@metrics.db_query
+async def add_log(user_id, post_id, event_type):
+    await pool.execute(
+        "INSERT INTO logs (user_id, post_id, event_type) VALUES ($1, $2, $3)",
+        user_id, post_id, event_type
+    )
+
+
+@metrics.db_query
+async def add_logs(events: list[tuple]):
+    """
+    Пишет пачку событий одним INSERT: events — (user_id, post_id, event_type, age),
+    где age — сколько секунд назад событие произошло (created_at считается на стороне БД).
+    """
+    user_ids, post_ids, event_types, ages = zip(*events)
+    await pool.execute(
+        """
+        INSERT INTO logs (user_id, post_id, event_type, created_at)
+        SELECT user_id, post_id, event_type, NOW() - make_interval(secs => age)
+        FROM unnest($1::int[], $2::int[], $3::text[], $4::float8[]) AS e(user_id, post_id, event_type, age)
+        """,
+        list(user_ids), list(post_ids), list(event_types), list(ages)
     )
-    conn.commit()
-    cur.close()
@@ -0,0 +1,97 @@
+# services/dedup.py
+#
+# Дубликаты при импорте постов.
+# Точные повторы отсекает БД: уникальный индекс (channel_id, text_hash), где text_hash = md5(text).
+# Почти одинаковые тексты (поправлена пара слов, другие кавычки/пробелы) ловит MinHash + LSH:
+# подпись из DEDUP_NUM_PERM минимумов хешей по словесным триграммам, разбитая на DEDUP_BANDS полос.
+# Кандидаты из общих корзин проверяются по доле совпавших позиций подписи (оценка сходства Жаккара).
+
+import re
+import zlib
+import hashlib
+import numpy as np
+from config import DEDUP_NEAR_THRESHOLD, DEDUP_NUM_PERM, DEDUP_BANDS
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+SHINGLE_SIZE = 3
+_PRIME = (1 << 31) - 1
+
+# Фиксированные коэффициенты, чтобы подписи были одинаковыми между запусками
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, _PRIME, DEDUP_NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, DEDUP_NUM_PERM, dtype=np.uint64)
+
+
+def text_hash(text: str) -> bytes:
+    """
+    Ключ точного дубликата; совпадает с decode(md5(text), 'hex') на стороне Postgres.
+    """
+    return hashlib.md5(text.encode("utf-8")).digest()
+
+
+def _shingles(text: str) -> set[str]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def signature(text: str) -> np.ndarray:
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in _shingles(text)], dtype=np.uint64)
+    # (a * h + b) mod p: a, b < 2^31 и h < 2^32, поэтому в uint64 переполнения нет
+    return ((np.outer(hashes, _A) + _B) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+class NearDuplicateFilter:
+    """
+    Потоковый фильтр почти-дубликатов: is_duplicate(text) отвечает, был ли уже похожий текст,
+    и запоминает новый. Память — одна подпись (DEDUP_NUM_PERM * 4 байта) на пост.
+    """
+
+    def __init__(self, threshold: float = DEDUP_NEAR_THRESHOLD, bands: int = DEDUP_BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = DEDUP_NUM_PERM // bands
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = []
+        self.skipped = 0
+
+    def _keys(self, sig: np.ndarray):
+        for band in range(self.bands):
+            yield band, sig[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, text: str):
+        self._add(signature(text))
+
+    def _add(self, sig: np.ndarray):
+        doc = len(self._signatures)
+        self._signatures.append(sig)
+        for band, key in self._keys(sig):
+            self._buckets[band].setdefault(key, []).append(doc)
+
+    def is_duplicate(self, text: str) -> bool:
+        sig = signature(text)
+        candidates = set()
+        for band, key in self._keys(sig):
+            candidates.update(self._buckets[band].get(key, ()))
+
+        for doc in candidates:
+            if np.mean(self._signatures[doc] == sig) >= self.threshold:
+                self.skipped += 1
+                return True
+
+        self._add(sig)
+        return False
+
+    def __len__(self):
+        return len(self._signatures)
+
+
+def seeded_filter(texts: list[str]) -> NearDuplicateFilter:
+    """
+    Фильтр, уже знающий существующие посты канала (сами они пропусками не считаются).
+    """
+    near = NearDuplicateFilter()
+    for text in texts:
+        near.add(text)
+    return near
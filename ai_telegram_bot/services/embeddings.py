@@ -0,0 +1,105 @@
+# services/embeddings.py
+#
+# Локальные векторы постов без внешних моделей: хешированные частоты слов (hashing trick).
+# Вектор — log(1 + tf) по EMBEDDING_DIM корзинам, хранится в posts.embedding как float16.
+# IDF считается по матрице канала при загрузке индекса (index_stats), в БД хранятся только частоты.
+
+import re
+import zlib
+import numpy as np
+from config import EMBEDDING_DIM
+
+DTYPE = np.float16
+# Матрица переводится во float32 кусками по столько строк, чтобы не делать копию целиком
+CHUNK_ROWS = 8192
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Грубая замена стемминга для русского: кроме слова целиком учитываем его начало
+STEM_LENGTH = 5
+
+
+def _features(text: str):
+    for word in _WORD_RE.findall(text.lower()):
+        if len(word) < 3 or word.isdigit():
+            continue
+        yield word
+        if len(word) > STEM_LENGTH:
+            yield word[:STEM_LENGTH]
+
+
+def embed(text: str) -> np.ndarray:
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for feature in _features(text):
+        vector[zlib.crc32(feature.encode("utf-8")) % EMBEDDING_DIM] += 1
+    return np.log1p(vector)
+
+
+def embed_many(texts: list[str]) -> np.ndarray:
+    matrix = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for i, text in enumerate(texts):
+        matrix[i] = embed(text)
+    return matrix
+
+
+def to_bytes(vector: np.ndarray) -> bytes:
+    return vector.astype(DTYPE).tobytes()
+
+
+def from_bytes(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype=DTYPE)
+
+
+def stack(blobs: list[bytes]) -> np.ndarray:
+    """
+    Склеивает сохранённые векторы в компактную матрицу (n, EMBEDDING_DIM) float16.
+    """
+    if not blobs:
+        return np.zeros((0, EMBEDDING_DIM), dtype=DTYPE)
+    return np.frombuffer(b"".join(blobs), dtype=DTYPE).reshape(len(blobs), EMBEDDING_DIM)
+
+
+def _chunks(matrix: np.ndarray):
+    for start in range(0, matrix.shape[0], CHUNK_ROWS):
+        yield matrix[start:start + CHUNK_ROWS].astype(np.float32)
+
+
+def index_stats(matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Квадраты весов IDF по столбцам и нормы строк с этими весами — считаются один раз
+    при загрузке индекса, а не на каждый запрос.
+    """
+    n = matrix.shape[0]
+    df = np.zeros(EMBEDDING_DIM, dtype=np.int64)
+    for chunk in _chunks(matrix):
+        df += np.count_nonzero(chunk, axis=0)
+    idf2 = ((np.log((n + 1) / (df + 1)) + 1) ** 2).astype(np.float32)
+
+    norms = np.zeros(n, dtype=np.float32)
+    for i, chunk in enumerate(_chunks(matrix)):
+        norms[i * CHUNK_ROWS:i * CHUNK_ROWS + len(chunk)] = np.sqrt((chunk * chunk) @ idf2)
+    norms[norms == 0] = 1
+    return idf2, norms
+
+
+def top_k(matrix: np.ndarray, query: np.ndarray, k: int, stats: tuple | None = None) -> list[tuple[int, float]]:
+    """
+    Индексы k строк matrix, ближайших к query по косинусу с весами TF-IDF.
+    stats — результат index_stats(matrix); если не передан, считается здесь.
+    Возвращает [(индекс строки, сходство), ...] по убыванию сходства; нулевое сходство отбрасывается.
+    """
+    n = matrix.shape[0]
+    if n == 0 or k <= 0:
+        return []
+
+    idf2, norms = stats if stats is not None else index_stats(matrix)
+    q_norm = np.sqrt((query * query) @ idf2)
+    if q_norm == 0:
+        return []
+
+    # cos(m_i * idf, q * idf) без построения взвешенной матрицы: только произведения на вектор
+    weighted = (query * idf2).astype(np.float32)
+    scores = np.concatenate([chunk @ weighted for chunk in _chunks(matrix)]) / (norms * q_norm)
+    k = min(k, n)
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return [(int(i), float(scores[i])) for i in best if scores[i] > 0]
@@ -0,0 +1,120 @@
+# services/event_log.py
+#
+# Буферизованный журнал событий (таблица logs): log_event() только кладёт событие в память,
+# а фоновая корутина пишет накопленное пачками — при EVENT_LOG_BATCH_SIZE событиях
+# или раз в EVENT_LOG_FLUSH_INTERVAL секунд. При остановке бота буфер сбрасывается.
+
+import asyncio
+import logging
+import time
+from collections import deque
+import asyncpg
+from services import database as db
+from services import metrics
+from config import EVENT_LOG_BATCH_SIZE, EVENT_LOG_FLUSH_INTERVAL, EVENT_LOG_MAX_BUFFER
+
+logger = logging.getLogger(__name__)
+
+_buffer: deque = deque()
+_wake = asyncio.Event()
+_flusher: asyncio.Task | None = None
+_stats = {"logged": 0, "written": 0, "dropped": 0, "batches": 0, "failed_batches": 0, "rejected": 0}
+# Ошибки, которые повтор не исправит: БД отвергает сами данные (например, пост уже удалён — нарушен FK)
+_REJECTED_ERRORS = (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError)
+
+
+def log_event(user_id: int | None, event_type: str, post_id: int | None = None):
+    """
+    Записывает событие в журнал. Не ждёт БД; если буфер переполнен, событие отбрасывается.
+    user_id — внутренний users.user_id (не telegram_id).
+    """
+    if len(_buffer) >= EVENT_LOG_MAX_BUFFER:
+        _stats["dropped"] += 1
+        metrics.EVENTS_DROPPED.inc()
+        return
+
+    _buffer.append((user_id, post_id, event_type, time.monotonic()))
+    _stats["logged"] += 1
+    if len(_buffer) >= EVENT_LOG_BATCH_SIZE:
+        _wake.set()
+
+
+async def flush():
+    """
+    Пишет всё накопленное. Незаписанный остаток пачки возвращается в буфер
+    (если там есть место) и уйдёт со следующим сбросом.
+    """
+    while _buffer:
+        batch = [_buffer.popleft() for _ in range(min(EVENT_LOG_BATCH_SIZE, len(_buffer)))]
+        try:
+            await _write(batch)
+        except asyncio.CancelledError:
+            # Остановка посреди записи — остаток допишется финальным flush() в stop()
+            _buffer.extendleft(reversed(batch))
+            raise
+        except Exception:
+            logger.exception("Failed to write %s log events", len(batch))
+            _stats["failed_batches"] += 1
+            room = EVENT_LOG_MAX_BUFFER - len(_buffer)
+            _stats["dropped"] += max(0, len(batch) - room)
+            _buffer.extendleft(reversed(batch[:room]))
+            return
+
+        _stats["batches"] += 1
+
+
+async def _write(batch: list):
+    """
+    Пишет события пачки, удаляя из неё записанные: если запись прервалась, в batch остаётся
+    ровно незаписанный остаток, и повтор не задвоит уже записанное.
+    Если БД отвергает данные, пишем части всё меньше, пока отвергнутое событие не останется одно, —
+    его отбрасываем, иначе оно блокировало бы журнал навсегда. Временные сбои пробрасываются наружу.
+    """
+    size = len(batch)
+    while batch:
+        part = batch[:size]
+        now = time.monotonic()
+        try:
+            await db.add_logs([(user_id, post_id, event_type, now - at) for user_id, post_id, event_type, at in part])
+        except _REJECTED_ERRORS:
+            if len(part) > 1:
+                size = (len(part) + 1) // 2
+                continue
+            logger.warning("Dropping log event %r rejected by the database", part[0][2], exc_info=True)
+            _stats["rejected"] += 1
+        else:
+            _stats["written"] += len(part)
+        del batch[:len(part)]
+        size = len(batch)
+
+
+async def _run():
+    while True:
+        try:
+            await asyncio.wait_for(_wake.wait(), EVENT_LOG_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+        await flush()
+
+
+def start():
+    global _flusher
+    if _flusher is None or _flusher.done():
+        _flusher = asyncio.create_task(_run())
+
+
+async def stop():
+    """
+    Останавливает фоновый сброс и дописывает остаток буфера (вызывать до закрытия пула БД).
+    """
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        await asyncio.gather(_flusher, return_exceptions=True)
+        _flusher = None
+    await flush()
+
+
+def stats() -> dict:
+    return {**_stats, "buffered": len(_buffer)}
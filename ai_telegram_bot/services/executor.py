@@ -0,0 +1,88 @@
+# services/executor.py
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import BLOCKING_WORKERS
+
+
+class BlockingExecutor:
+    """
+    Ограниченный пул потоков для блокирующей работы, которую нельзя делать в event loop
+    (чтение временных файлов, разбор CSV, подсчёт хэшей и т.п.).
+    Считает глубину очереди и время ожидания свободного потока.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="blocking")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def run(self, func, *args):
+        submitted = time.monotonic()
+        with self._lock:
+            self.queued += 1
+
+        def call():
+            waited = time.monotonic() - submitted
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        return await asyncio.get_running_loop().run_in_executor(self._pool, call)
+
+    async def iterate(self, iterable, batch_size: int):
+        """
+        Асинхронно перебирает синхронный итератор, забирая элементы пачками в пуле потоков.
+        """
+        iterator = iter(iterable)
+
+        def next_batch():
+            batch = []
+            for item in iterator:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    break
+            return batch
+
+        while True:
+            batch = await self.run(next_batch)
+            if not batch:
+                return
+            for item in batch:
+                yield item
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "wait_avg": self.wait_total / self.completed if self.completed else 0.0,
+                "wait_max": self.wait_max,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+executor = BlockingExecutor(BLOCKING_WORKERS)
+
+
+async def run_blocking(func, *args):
+    return await executor.run(func, *args)
@@ -0,0 +1,125 @@
+# services/importer.py
+
+import csv
+import io
+import tempfile
+from contextlib import asynccontextmanager
+from config import IMPORT_MAX_FILE_SIZE, IMPORT_MAX_ROWS, IMPORT_MEMORY_BUFFER
+
+DEFAULT_STYLE = "ручной ввод"
+
+
+class ImportLimitError(Exception):
+    """Файл превышает допустимый размер или количество постов."""
+
+
+# -------------------------
+# Загрузка файла
+# -------------------------
+def check_document(document):
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        raise ImportLimitError(
+            f"Файл слишком большой: максимум {IMPORT_MAX_FILE_SIZE // (1024 * 1024)} МБ"
+        )
+
+
+@asynccontextmanager
+async def open_document(document):
+    """
+    Скачивает документ Telegram в буфер: небольшие файлы остаются в памяти,
+    крупные сбрасываются во временный файл, который удаляется при выходе.
+    Отдаёт текстовый поток для парсеров ниже.
+    """
+    check_document(document)
+
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_MEMORY_BUFFER) as buffer:
+        file = await document.get_file()
+        await file.download_to_memory(out=buffer)
+        buffer.seek(0)
+
+        stream = io.TextIOWrapper(buffer, encoding="utf-8-sig", newline="")
+        try:
+            yield stream
+        finally:
+            stream.detach()
+
+
+# -------------------------
+# Парсеры
+# -------------------------
+def parse_line_style(line: str):
+    style = DEFAULT_STYLE
+    if "Стиль:" in line:
+        parts = line.rsplit("Стиль:", 1)
+        text = parts[0].strip()
+        style = parts[1].strip()
+    else:
+        text = line.strip()
+    return text, style
+
+
+def _parse_txt_block(block: str):
+    block = block.strip()
+    if not block:
+        return None
+
+    if "Стиль:" in block:
+        text_part, style_part = block.split("Стиль:", 1)
+        text = text_part.strip().strip('"')
+        style = style_part.strip().strip('"')
+    else:
+        text = block.strip().strip('"')
+        style = DEFAULT_STYLE
+
+    return (text, style) if text else None
+
+
+def iter_txt_posts(stream):
+    """
+    Построчно читает .txt в формате "Пост: ... Стиль: ..." и отдаёт (text, style).
+    В памяти держится только текущий пост.
+    """
+    block = []
+    for line in stream:
+        parts = line.split("Пост:")
+        block.append(parts[0])
+        for part in parts[1:]:
+            post = _parse_txt_block("".join(block))
+            if post:
+                yield post
+            block = [part]
+
+    post = _parse_txt_block("".join(block))
+    if post:
+        yield post
+
+
+def iter_csv_posts(stream):
+    """
+    Читает .csv: первая колонка — текст, вторая (необязательно) — стиль.
+    """
+    for row in csv.reader(stream):
+        if not row:
+            continue
+        if len(row) == 1:
+            text, style = parse_line_style(row[0])
+        else:
+            text, style = row[0], row[1]
+        yield text.strip(), style
+
+
+def iter_posts(stream, file_name: str, max_rows: int = IMPORT_MAX_ROWS):
+    """
+    Выбирает парсер по расширению файла и следит за лимитом на количество постов.
+    """
+    if file_name.endswith(".txt"):
+        parser = iter_txt_posts(stream)
+    elif file_name.endswith(".csv"):
+        parser = iter_csv_posts(stream)
+    else:
+        raise ValueError(f"Неподдерживаемый формат файла: {file_name}")
+
+    for count, post in enumerate(parser, start=1):
+        if count > max_rows:
+            raise ImportLimitError(f"В файле больше {max_rows} постов")
+        yield post
@@ -0,0 +1,206 @@
+# services/jobs.py
+#
+# Фоновые задачи: обработчик апдейта только ставит задачу в таблицу jobs и сразу отвечает,
+# а тяжёлую работу (скачивание и разбор файла, массовая вставка) выполняют воркеры-корутины.
+# Прогресс показывается правкой сообщения с кнопкой «Отменить».
+
+import asyncio
+import logging
+import time
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from services import database as db
+from services import metrics
+from config import (
+    JOB_WORKERS,
+    JOB_POLL_INTERVAL,
+    JOB_PROGRESS_INTERVAL,
+    JOB_STALE_AFTER,
+    JOB_HEARTBEAT_INTERVAL,
+    JOB_ERROR_BACKOFF_MAX,
+)
+
+logger = logging.getLogger(__name__)
+
+_handlers: dict = {}
+_workers: list[asyncio.Task] = []
+_wake = asyncio.Event()
+# job_id задач, которые выполняет этот процесс (для heartbeat)
+_running: set[int] = set()
+
+
+class JobCancelled(Exception):
+    """Пользователь отменил задачу."""
+
+
+def job_handler(kind: str):
+    """
+    Регистрирует корутину async def handler(job: Job) -> dict | None для задач вида kind.
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def cancel_markup(job_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton("✖ Отменить", callback_data=f"cancel_job_{job_id}")]])
+
+
+class Job:
+    def __init__(self, row: dict, bot: Bot):
+        self.job_id = row["job_id"]
+        self.kind = row["kind"]
+        self.payload = row["payload"]
+        self.chat_id = row["chat_id"]
+        self.message_id = row["message_id"]
+        self.bot = bot
+        self._last_progress = time.monotonic()
+
+    async def report(self, text: str, cancellable: bool = False):
+        """
+        Правит сообщение задачи (если оно есть).
+        """
+        if self.message_id is None:
+            return
+        try:
+            await self.bot.edit_message_text(
+                text,
+                chat_id=self.chat_id,
+                message_id=self.message_id,
+                reply_markup=cancel_markup(self.job_id) if cancellable else None,
+            )
+        except BadRequest:
+            pass
+
+    async def progress(self, value: int, text: str):
+        """
+        Не чаще раза в JOB_PROGRESS_INTERVAL сохраняет прогресс, обновляет сообщение
+        и проверяет запрос отмены — в этом случае бросает JobCancelled.
+        """
+        now = time.monotonic()
+        if now - self._last_progress < JOB_PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+
+        if await db.update_job_progress(self.job_id, value):
+            raise JobCancelled()
+        await self.report(text, cancellable=True)
+
+
+# -------------------------
+# Постановка и отмена
+# -------------------------
+async def enqueue(kind: str, payload: dict, chat_id: int = None, message_id: int = None) -> int:
+    job_id = await db.enqueue_job(kind, payload, chat_id, message_id)
+    _wake.set()
+    return job_id
+
+
+async def cancel(job_id: int, chat_id: int):
+    """
+    Возвращает 'cancelled' (задача ещё не началась и снята), 'running' (воркер остановит её
+    при ближайшей проверке) или None, если задача уже завершена.
+    """
+    return await db.request_job_cancel(job_id, chat_id)
+
+
+# -------------------------
+# Воркеры
+# -------------------------
+async def start(bot: Bot, workers: int = JOB_WORKERS):
+    """
+    Запускает воркеры в текущем event loop (вызывается из post_init).
+    """
+    requeued = await db.requeue_stale_jobs(JOB_STALE_AFTER)
+    if requeued:
+        logger.info("Requeued %s stale jobs", requeued)
+
+    for n in range(workers):
+        _workers.append(asyncio.create_task(_worker(bot), name=f"job-worker-{n}"))
+    _workers.append(asyncio.create_task(_housekeeping(), name="job-housekeeping"))
+
+
+async def stop():
+    """
+    Останавливает воркеры. Прерванные задачи возвращаются в очередь и выполнятся заново.
+    """
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+async def _worker(bot: Bot):
+    failures = 0
+    while True:
+        try:
+            job = await db.claim_job()
+            if job is None:
+                _wake.clear()
+                try:
+                    await asyncio.wait_for(_wake.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await _run(Job(job, bot))
+            failures = 0
+        except Exception:
+            # Сбой БД или Bot API не должен останавливать воркер насовсем.
+            # Недовершённая задача останется 'running' и вернётся в очередь через _housekeeping()
+            failures += 1
+            logger.exception("Job worker error, retrying")
+            metrics.ERRORS.labels("job").inc()
+            await asyncio.sleep(min(JOB_POLL_INTERVAL * 2 ** (failures - 1), JOB_ERROR_BACKOFF_MAX))
+
+
+async def _housekeeping():
+    """
+    Раз в JOB_HEARTBEAT_INTERVAL продлевает heartbeat своих задач (долгий шаг без progress()
+    не должен выглядеть как упавший воркер) и возвращает в очередь задачи упавших процессов.
+    """
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            if _running:
+                await db.touch_jobs(list(_running))
+            requeued = await db.requeue_stale_jobs(JOB_STALE_AFTER)
+            if requeued:
+                logger.info("Requeued %s stale jobs", requeued)
+                _wake.set()
+        except Exception:
+            logger.exception("Job housekeeping failed")
+            metrics.ERRORS.labels("job").inc()
+
+
+async def _run(job: Job):
+    handler = _handlers.get(job.kind)
+    if handler is None:
+        logger.error("No handler for job %s of kind %s", job.job_id, job.kind)
+        await db.finish_job(job.job_id, "failed", error=f"unknown kind {job.kind}")
+        return
+
+    started = time.perf_counter()
+    _running.add(job.job_id)
+    try:
+        result = await handler(job)
+    except JobCancelled:
+        await db.finish_job(job.job_id, "cancelled")
+    except asyncio.CancelledError:
+        # Остановка процесса: задача выполнится заново после перезапуска
+        await asyncio.shield(db.requeue_job(job.job_id))
+        raise
+    except Exception as e:
+        logger.exception("Job %s (%s) failed", job.job_id, job.kind)
+        metrics.ERRORS.labels("job").inc()
+        await db.finish_job(job.job_id, "failed", error=repr(e))
+        try:
+            await job.report("⚠️ Не удалось выполнить задачу, попробуйте ещё раз.")
+        except Exception:
+            logger.exception("Failed to report failure of job %s", job.job_id)
+    else:
+        await db.finish_job(job.job_id, "done", result=result)
+    finally:
+        _running.discard(job.job_id)
+        metrics.JOB_SECONDS.labels(job.kind).observe(time.perf_counter() - started)
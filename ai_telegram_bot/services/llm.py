@@ -1,49 +1,609 @@
 # services/llm.py
 
 import re
+import json
+import time
+import heapq
+import hashlib
+import random
+import logging
+import itertools
 import openai
 import aiohttp
 import asyncio
-from config import OPENAI_API_KEY, PROXY_URL
+from contextlib import asynccontextmanager
+from services import completion_cache, metrics
+from services.prompt_builder import fit_history, log_prompt_size
+from config import (
+    OPENAI_API_KEY,
+    OPENAI_API_URL,
+    PROXY_URL,
+    LLM_POOL_SIZE,
+    LLM_POOL_PER_HOST,
+    LLM_KEEPALIVE_TIMEOUT,
+    LLM_MAX_CONCURRENCY,
+    LLM_PER_USER_CONCURRENCY,
+    LLM_RPM_LIMIT,
+    LLM_CONNECT_TIMEOUT,
+    LLM_READ_TIMEOUT,
+    LLM_TOTAL_TIMEOUT,
+    LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+    LLM_BREAKER_THRESHOLD,
+    LLM_BREAKER_COOLDOWN,
+)
 
 openai.api_key = OPENAI_API_KEY
 
+logger = logging.getLogger(__name__)
+
+LLM_MODEL = "gpt-4o-mini"
+LLM_TEMPERATURE = 0.7
+
+_session: aiohttp.ClientSession | None = None
+_stats = {"requests": 0, "connections_created": 0, "connections_reused": 0}
+
+
+# -------------------------
+# Общая HTTP-сессия
+# -------------------------
+async def _on_connection_create(session, ctx, params):
+    _stats["connections_created"] += 1
+
+
+async def _on_connection_reuse(session, ctx, params):
+    _stats["connections_reused"] += 1
+
+
+async def init_session():
+    """
+    Создаёт долгоживущую сессию aiohttp с keep-alive.
+    Вызывается один раз при старте бота.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        return
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(_on_connection_create)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuse)
+
+    connector = aiohttp.TCPConnector(
+        ssl=False,
+        limit=LLM_POOL_SIZE,
+        limit_per_host=LLM_POOL_PER_HOST,
+        keepalive_timeout=LLM_KEEPALIVE_TIMEOUT,
+    )
+    _session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def get_session_stats() -> dict:
+    """
+    Метрики переиспользования соединений: сколько запросов отправлено,
+    сколько соединений открыто заново и сколько взято из пула.
+    """
+    return dict(_stats)
+
+
+# -------------------------
+# Диспетчер запросов
+# -------------------------
+PRIORITY_INTERACTIVE = 0    # пользователь ждёт ответа прямо сейчас
+PRIORITY_BACKGROUND = 1     # фоновый пересчёт, спекулятивные черновики
+
+
+class DispatchPriority:
+    """
+    Приоритет запроса, который можно повысить, пока запрос ждёт слот: например, спекулятивный
+    черновик становится интерактивным, когда пользователь выбрал его стиль.
+    """
+
+    def __init__(self, value: int):
+        self.value = value
+        self._waiter = None         # (номер в очереди, future) в _global_slots, пока запрос ждёт слот
+        self._followers = []        # приоритеты уже идущих запросов, к которым склеен этот
+
+    def promote(self, value: int = PRIORITY_INTERACTIVE):
+        for follower in self._followers:
+            follower.promote(value)
+        if value >= self.value:
+            return
+        self.value = value
+        if self._waiter is not None and not self._waiter[1].done():
+            _global_slots.requeue(*self._waiter, value)
+
+    def follow(self, other: "DispatchPriority"):
+        """
+        Запрос склеен с уже идущим other и ждёт его ответа, поэтому повышение передаётся ему.
+        """
+        self._followers.append(other)
+        other.promote(self.value)
+
+    def __repr__(self):
+        return str(self.value)
+
+
+def _as_priority(priority) -> DispatchPriority:
+    return priority if isinstance(priority, DispatchPriority) else DispatchPriority(priority)
+
+
+class _PrioritySlots:
+    """
+    Глобальный лимит одновременных запросов: свободный слот получает
+    ожидающий с наименьшим приоритетом (интерактивные раньше фоновых).
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiters = []
+        self._seq = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        # После requeue() один future может лежать в очереди дважды
+        return len({id(fut) for *_, fut in self._waiters if not fut.done()})
+
+    async def acquire(self, priority: DispatchPriority):
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        seq = next(self._seq)
+        heapq.heappush(self._waiters, (priority.value, seq, fut))
+        priority._waiter = (seq, fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # Слот уже передали нам, но задачу отменили — отдаём его следующему
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+        finally:
+            priority._waiter = None
+
+    def requeue(self, seq: int, fut: asyncio.Future, priority: int):
+        """
+        Ставит ждущий future в очередь с новым приоритетом, сохраняя его место по времени прихода.
+        Старая запись остаётся, но release() её пропустит: к тому времени future уже будет выполнен.
+        """
+        heapq.heappush(self._waiters, (priority, seq, fut))
+
+    def release(self):
+        while self._waiters:
+            *_, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+
+class _TokenBucket:
+    """
+    Ограничение частоты запросов под лимит тарифа OpenAI (запросов в минуту).
+    """
+
+    def __init__(self, rate_per_minute: int):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1, rate_per_minute // 6)  # всплеск — до 10 секунд лимита
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+_global_slots = _PrioritySlots(LLM_MAX_CONCURRENCY)
+_rate_limiter = _TokenBucket(LLM_RPM_LIMIT)
+_user_slots: dict[int, list] = {}                   # user_id -> [Semaphore, сколько запросов его держат]
+_inflight: dict[str, "_InflightRequest"] = {}      # ключ промпта -> запрос, который ждут все дубли
+_dispatch_stats = {"dispatched": 0, "coalesced": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+
+class _InflightRequest:
+    """
+    Запрос к OpenAI, который ждут один или несколько вызовов ask_openai с одинаковым промптом.
+    """
+
+    def __init__(self, task: asyncio.Task, priority: DispatchPriority):
+        self.task = task
+        self.priority = priority
+        self.waiters = 0
+
+
+@asynccontextmanager
+async def _dispatch_slot(user_id: int | None, priority: DispatchPriority):
+    """
+    Пропускает запрос через лимиты: на пользователя, общий (с приоритетом) и по частоте.
+    """
+    started = time.monotonic()
+
+    user_slot = None
+    if user_id is not None:
+        user_slot = _user_slots.setdefault(user_id, [asyncio.Semaphore(LLM_PER_USER_CONCURRENCY), 0])
+        user_slot[1] += 1
+
+    try:
+        if user_slot:
+            await user_slot[0].acquire()
+        try:
+            await _global_slots.acquire(priority)
+            try:
+                await _rate_limiter.acquire()
+
+                waited = time.monotonic() - started
+                _dispatch_stats["dispatched"] += 1
+                _dispatch_stats["wait_total"] += waited
+                _dispatch_stats["wait_max"] = max(_dispatch_stats["wait_max"], waited)
+                logger.info("LLM queue wait %.3fs (user=%s, priority=%s)", waited, user_id, priority)
+
+                yield waited
+            finally:
+                _global_slots.release()
+        finally:
+            if user_slot:
+                user_slot[0].release()
+    finally:
+        if user_slot:
+            user_slot[1] -= 1
+            if user_slot[1] == 0:
+                _user_slots.pop(user_id, None)
+
+
+def get_dispatch_stats() -> dict:
+    """
+    Состояние диспетчера: сколько запросов отправлено, сколько склеено с уже идущими,
+    среднее/максимальное ожидание в очереди и текущая загрузка.
+    """
+    dispatched = _dispatch_stats["dispatched"]
+    return {
+        "dispatched": dispatched,
+        "coalesced": _dispatch_stats["coalesced"],
+        "wait_avg": _dispatch_stats["wait_total"] / dispatched if dispatched else 0.0,
+        "wait_max": _dispatch_stats["wait_max"],
+        "active": _global_slots.active,
+        "waiting": _global_slots.waiting,
+    }
+
+
+def _prompt_key(prompt: str) -> str:
+    """
+    Ключ запроса для склейки дублей и кэша ответов: нормализованный промпт + модель + температура.
+    """
+    normalized = " ".join(prompt.split())
+    return hashlib.sha256(f"{LLM_MODEL}\0{LLM_TEMPERATURE}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+# -------------------------
+# Ошибки, повторы и предохранитель
+# -------------------------
+class LLMError(ValueError):
+    """Не удалось получить ответ от OpenAI."""
+
+
+class LLMUnavailableError(LLMError):
+    """OpenAI недоступен: предохранитель разомкнут, запросы временно не отправляются."""
+
+
+class _RetryableError(LLMError):
+    def __init__(self, message: str, retry_after: float | None = None, trips_breaker: bool = True):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.trips_breaker = trips_breaker
+
+
+class _CircuitBreaker:
+    """
+    После LLM_BREAKER_THRESHOLD сбоев подряд перестаёт пускать запросы на LLM_BREAKER_COOLDOWN секунд,
+    затем пропускает один пробный: если он успешен — работа восстанавливается.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    def before_call(self) -> bool:
+        """
+        Пропускает запрос или бросает LLMUnavailableError. Возвращает True, если запрос пробный.
+        """
+        if self.opened_at is None:
+            return False
+        if time.monotonic() - self.opened_at < self.cooldown or self.trial_in_progress:
+            raise LLMUnavailableError("OpenAI временно недоступен, попробуйте позже")
+        self.trial_in_progress = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_in_progress or self.failures >= self.threshold:
+            if self.opened_at is None or self.trial_in_progress:
+                logger.warning("LLM circuit breaker opened after %s failures", self.failures)
+            self.opened_at = time.monotonic()
+            self.trial_in_progress = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.trial_in_progress else "open"
+
+
+_breaker = _CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN)
+
+
+def _backoff_delay(attempt: int, retry_after: float | None) -> float:
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _retry_after(resp) -> float | None:
+    try:
+        return float(resp.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+async def _raise_for_status(resp):
+    if resp.status == 200:
+        return
+    text = await resp.text()
+    message = f"Ошибка OpenAI API: {resp.status}, ответ: {text}"
+    if resp.status == 429:
+        # Упёрлись в лимит тарифа — повторяем, но сервис при этом жив
+        raise _RetryableError(message, _retry_after(resp), trips_breaker=False)
+    if resp.status >= 500:
+        raise _RetryableError(message, _retry_after(resp))
+    raise LLMError(message)
+
+
+async def _with_retries(call):
+    """
+    Выполняет call() с повторами на 429/5xx/таймаутах/обрывах соединения
+    и учётом состояния предохранителя.
+    """
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        is_trial = _breaker.before_call()
+        try:
+            result = await call()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = _RetryableError(f"Ошибка соединения с OpenAI: {e!r}")
+        except _RetryableError as e:
+            error = e
+        except LLMError:
+            # 4xx — ошибка в самом запросе, сервис при этом отвечает
+            _breaker.record_success()
+            raise
+        except BaseException:
+            # Отмена или непредвиденная ошибка: пробный запрос ничего не показал,
+            # но предохранитель не должен навсегда остаться «полуоткрытым»
+            if is_trial:
+                _breaker.trial_in_progress = False
+            raise
+        else:
+            _breaker.record_success()
+            return result
+
+        if error.trips_breaker:
+            _breaker.record_failure()
+        elif is_trial:
+            _breaker.trial_in_progress = False
+        if attempt == LLM_MAX_RETRIES:
+            metrics.ERRORS.labels("llm").inc()
+            raise LLMError(str(error)) from error
+
+        delay = _backoff_delay(attempt, error.retry_after)
+        logger.warning("OpenAI request failed (%s), retry %s in %.1fs", error, attempt + 1, delay)
+        await asyncio.sleep(delay)
+
+
+def get_breaker_state() -> str:
+    return _breaker.state
+
+
+def _record_usage(usage: dict):
+    metrics.LLM_TOKENS.labels("prompt").inc(usage.get("prompt_tokens", 0))
+    metrics.LLM_TOKENS.labels("completion").inc(usage.get("completion_tokens", 0))
+
 
 # -------------------------
 # Асинхронный запрос к OpenAI
 # -------------------------
-async def ask_openai(prompt: str) -> str:
+def _request_kwargs(prompt: str, stream: bool = False) -> dict:
+    payload = {
+        "model": LLM_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": LLM_TEMPERATURE,
+    }
+    if stream:
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+
+    return {
+        "proxy": PROXY_URL or None,
+        "headers": {
+            "Authorization": f"Bearer {OPENAI_API_KEY}",
+            "Content-Type": "application/json",
+        },
+        "json": payload,
+        "timeout": aiohttp.ClientTimeout(
+            # Стрим может идти долго, поэтому для него ограничиваем только паузы между кусочками
+            total=None if stream else LLM_TOTAL_TIMEOUT,
+            connect=LLM_CONNECT_TIMEOUT,
+            sock_read=LLM_READ_TIMEOUT,
+        ),
+    }
+
+
+async def ask_openai(
+    prompt: str, user_id: int | None = None, priority: int | DispatchPriority = PRIORITY_INTERACTIVE,
+    use_cache: bool = True
+) -> str:
     """
     Отправка запроса в OpenAI GPT с поддержкой прокси.
+    Готовые ответы берутся из кэша (use_cache=False — сгенерировать заново).
+    Одинаковые промпты, которые уже в работе, не отправляются повторно —
+    все вызовы ждут один и тот же ответ, а идущий запрос получает наивысший из их приоритетов.
+    priority можно передать как DispatchPriority, чтобы повысить его позже (promote()).
+    При 429/5xx/таймаутах запрос повторяется, после всех попыток бросается LLMError.
+    """
+    key = _prompt_key(prompt)
+    if use_cache:
+        cached = await completion_cache.get(key)
+        if cached is not None:
+            return cached
+
+    priority = _as_priority(priority)
+    request = _inflight.get(key)
+    if request is not None:
+        _dispatch_stats["coalesced"] += 1
+        priority.follow(request.priority)
+    else:
+        request = _InflightRequest(asyncio.create_task(_ask_openai(prompt, key, user_id, priority)), priority)
+        _inflight[key] = request
+        request.task.add_done_callback(lambda t: _forget_inflight(key, request))
+
+    # shield — чтобы отмена одного ждущего не обрывала запрос для остальных
+    request.waiters += 1
+    try:
+        return await asyncio.shield(request.task)
+    finally:
+        request.waiters -= 1
+        if request.waiters == 0 and not request.task.done():
+            # Все ждущие отменены: ответ никому не нужен — освобождаем слоты и не тратим токены
+            _forget_inflight(key, request)
+            request.task.cancel()
+
+
+def _forget_inflight(key: str, request: _InflightRequest):
+    if _inflight.get(key) is request:
+        del _inflight[key]
+
+
+async def _ask_openai(prompt: str, key: str, user_id: int | None, priority: DispatchPriority) -> str:
+    if _session is None or _session.closed:
+        await init_session()
+
+    async def attempt():
+        async with _dispatch_slot(user_id, priority):
+            _stats["requests"] += 1
+            started = time.perf_counter()
+            async with _session.post(OPENAI_API_URL, **_request_kwargs(prompt)) as resp:
+                metrics.LLM_FIRST_BYTE_SECONDS.labels("complete").observe(time.perf_counter() - started)
+                await _raise_for_status(resp)
+                data = await resp.json()
+            metrics.LLM_SECONDS.labels("complete").observe(time.perf_counter() - started)
+            return data
+
+    data = await _with_retries(attempt)
+    content = data["choices"][0]["message"]["content"]
+    usage = data.get("usage") or {}
+    _record_usage(usage)
+    await completion_cache.put(key, content, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+    return content
+
+
+async def ask_openai_stream(
+    prompt: str, user_id: int | None = None, priority: int = PRIORITY_INTERACTIVE, use_cache: bool = True
+):
+    """
+    Потоковый запрос к OpenAI (SSE, stream=true).
+    Отдаёт кусочки текста по мере их генерации; ответ из кэша отдаётся одним куском.
+    Повторяется только установка стрима: если он оборвался на середине, бросается LLMError.
     """
-    connector = aiohttp.TCPConnector(ssl=False)
-
-    async with aiohttp.ClientSession(connector=connector) as session:
-        async with session.post(
-            "https://api.openai.com/v1/chat/completions",
-            proxy=PROXY_URL,
-            headers={
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": "gpt-4o-mini",
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.7,
-            },
-        ) as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                raise ValueError(f"Ошибка OpenAI API: {resp.status}, ответ: {text}")
-
-            data = await resp.json()
-            return data["choices"][0]["message"]["content"]
+    key = _prompt_key(prompt)
+    if use_cache:
+        cached = await completion_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    if _session is None or _session.closed:
+        await init_session()
+
+    async with _dispatch_slot(user_id, _as_priority(priority)):
+        started = time.perf_counter()
+
+        async def open_stream():
+            _stats["requests"] += 1
+            resp = await _session.post(OPENAI_API_URL, **_request_kwargs(prompt, stream=True))
+            try:
+                await _raise_for_status(resp)
+            except BaseException:
+                resp.release()
+                raise
+            return resp
+
+        resp = await _with_retries(open_stream)
+        content = []
+        usage = {}
+        try:
+            async for raw_line in resp.content:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+
+                chunk = json.loads(data)
+                usage = chunk.get("usage") or usage
+                choices = chunk.get("choices") or []
+                if not choices:
+                    continue
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    if not content:
+                        metrics.LLM_FIRST_BYTE_SECONDS.labels("stream").observe(time.perf_counter() - started)
+                    content.append(delta)
+                    yield delta
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            _breaker.record_failure()
+            metrics.ERRORS.labels("llm").inc()
+            raise LLMError(f"Стрим OpenAI оборвался: {e!r}") from e
+        finally:
+            resp.release()
+        metrics.LLM_SECONDS.labels("stream").observe(time.perf_counter() - started)
+
+    _record_usage(usage)
+    if content:
+        await completion_cache.put(
+            key, "".join(content), usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        )
 
 
 # -------------------------
 # Генерация идей + стилей
 # -------------------------
-async def generate_post_ideas(posts: list[str]) -> list[dict]:
+async def generate_post_ideas(
+    posts: list[str], user_id: int | None = None, priority: int = PRIORITY_INTERACTIVE
+) -> list[dict]:
     """
     На основе последних постов генерируем 3 идеи и стили для каждой.
     Формат ответа: [{"idea": "Название", "styles": ["Стиль1", "Стиль2", "Стиль3"]}, ...]
@@ -51,7 +611,7 @@ async def generate_post_ideas(posts: list[str]) -> list[dict]:
     prompt = (
         "Ты — помощник для создания контента в телеграм-канале.\n"
         "На основе этих постов:\n"
-        + "\n".join(posts)
+        + "\n".join(fit_history(posts))
         + "\n\nСгенерируй 3 новые идеи для постов (каждая идея короткая в два-три слова). "
         "Для каждой идеи предложи 3 возможных стиля (в одно-два слова).\n"
         "Отвечай строго в формате:\n"
@@ -60,7 +620,8 @@ async def generate_post_ideas(posts: list[str]) -> list[dict]:
         "3. <Идея>\n   - <Стиль 1>\n   - <Стиль 2>\n   - <Стиль 3>\n"
     )
 
-    resp = await ask_openai(prompt)
+    log_prompt_size("ideas", prompt)
+    resp = await ask_openai(prompt, user_id, priority)
     ideas = []
 
     current = None
@@ -95,20 +656,42 @@ async def generate_post_ideas(posts: list[str]) -> list[dict]:
 # -------------------------
 # Генерация черновика поста
 # -------------------------
-async def generate_post_draft(channel_name: str, idea: str, style: str, posts: list[str]) -> str:
-    """
-    Генерирует черновик поста по выбранной идее и стилю.
-    Включает последние посты канала для сохранения тематики.
-    """
+def _draft_prompt(channel_name: str, idea: str, style: str, posts: list[str]) -> str:
+    posts = fit_history(posts)
     recent_posts = "\n".join(posts) if posts else "Нет предыдущих постов."
 
-    prompt = (
+    return (
         f"Ты пишешь пост для телеграм-канала '{channel_name}'.\n\n"
-        f"Последние (прошлые) посты канала:\n{recent_posts}\n\n"
+        f"Прошлые посты канала, близкие к теме:\n{recent_posts}\n\n"
         f"Выбранная тема поста: {idea}\n"
         f"Выбранный стиль поста: {style}\n\n"
         "Создай связный телеграм-пост, "
         "чтобы он соответствовал выбранным теме и стилю, а также сохранял общую тематику прошлых постов."
     )
-    draft = await ask_openai(prompt)
+
+
+async def generate_post_draft(
+    channel_name: str, idea: str, style: str, posts: list[str],
+    user_id: int | None = None, priority: int | DispatchPriority = PRIORITY_INTERACTIVE, use_cache: bool = True,
+) -> str:
+    """
+    Генерирует черновик поста по выбранной идее и стилю.
+    posts — прошлые посты канала, близкие к идее (retrieval.posts_for_draft), для сохранения тематики.
+    """
+    prompt = _draft_prompt(channel_name, idea, style, posts)
+    log_prompt_size("draft", prompt)
+    draft = await ask_openai(prompt, user_id, priority, use_cache)
     return draft.strip()
+
+
+async def stream_post_draft(
+    channel_name: str, idea: str, style: str, posts: list[str],
+    user_id: int | None = None, use_cache: bool = True,
+):
+    """
+    То же, что generate_post_draft, но отдаёт текст черновика по кусочкам.
+    """
+    prompt = _draft_prompt(channel_name, idea, style, posts)
+    log_prompt_size("draft", prompt)
+    async for delta in ask_openai_stream(prompt, user_id, use_cache=use_cache):
+        yield delta
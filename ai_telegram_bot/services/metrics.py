@@ -0,0 +1,128 @@
+# services/metrics.py
+#
+# Метрики Prometheus: время обработчиков, запросов к БД, к OpenAI и к Bot API, токены,
+# попадания в кэши и ошибки. Отдаются на /metrics (порт METRICS_PORT).
+#
+# prometheus_client — необязательная зависимость: если его нет или METRICS_ENABLED = False,
+# декораторы возвращают функцию как есть, а метрики — пустые заглушки.
+
+import time
+import logging
+import functools
+from telegram.request import HTTPXRequest
+from config import METRICS_ENABLED, METRICS_PORT
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+enabled = METRICS_ENABLED and prometheus_client is not None
+if METRICS_ENABLED and prometheus_client is None:
+    logger.warning("METRICS_ENABLED is set but prometheus_client is not installed, metrics are disabled")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+def _histogram(name: str, documentation: str, labels: list[str]):
+    if not enabled:
+        return _NoopMetric()
+    return prometheus_client.Histogram(name, documentation, labels, buckets=LATENCY_BUCKETS)
+
+
+def _counter(name: str, documentation: str, labels: list[str]):
+    if not enabled:
+        return _NoopMetric()
+    return prometheus_client.Counter(name, documentation, labels)
+
+
+HANDLER_SECONDS = _histogram("bot_handler_seconds", "Время работы обработчика апдейта", ["handler"])
+DB_SECONDS = _histogram("bot_db_query_seconds", "Время запроса к Postgres", ["query"])
+TELEGRAM_SECONDS = _histogram("bot_telegram_request_seconds", "Время запроса к Bot API", ["method"])
+JOB_SECONDS = _histogram("bot_job_seconds", "Время выполнения фоновой задачи", ["kind"])
+LLM_SECONDS = _histogram("bot_llm_request_seconds", "Время запроса к OpenAI целиком", ["mode"])
+LLM_FIRST_BYTE_SECONDS = _histogram(
+    "bot_llm_first_byte_seconds", "Время до первого байта ответа OpenAI (для стрима — до первого текста)", ["mode"]
+)
+LLM_TOKENS = _counter("bot_llm_tokens_total", "Потрачено токенов OpenAI", ["kind"])
+CACHE_EVENTS = _counter("bot_cache_events_total", "Обращения к кэшам", ["cache", "result"])
+ERRORS = _counter("bot_errors_total", "Ошибки по источникам", ["source"])
+EVENTS_DROPPED = _counter("bot_event_log_dropped_total", "События журнала, отброшенные при переполнении буфера", [])
+
+
+def timed(histogram, label: str, error_source: str | None = None):
+    """
+    Декоратор корутины: пишет её время в histogram с меткой label,
+    исключения (если задан error_source) считает в ERRORS.
+    """
+    def decorator(func):
+        if not enabled:
+            return func
+
+        metric = histogram.labels(label)
+        errors = ERRORS.labels(error_source) if error_source else None
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc()
+                raise
+            finally:
+                metric.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def handler(func):
+    return timed(HANDLER_SECONDS, func.__name__, "handler")(func)
+
+
+def db_query(func):
+    return timed(DB_SECONDS, func.__name__, "db")(func)
+
+
+class TelegramRequest(HTTPXRequest):
+    """
+    HTTPXRequest, который замеряет каждый вызов Bot API (sendMessage, editMessageText, ...).
+    """
+
+    def __init__(self, connection_pool_size: int = 256, **kwargs):
+        # 256 — как у запросов бота по умолчанию в ApplicationBuilder
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            ERRORS.labels("telegram").inc()
+            raise
+        finally:
+            TELEGRAM_SECONDS.labels(url.rsplit("/", 1)[-1]).observe(time.perf_counter() - started)
+
+
+def start_server(port: int = METRICS_PORT):
+    """
+    Поднимает /metrics в фоновом потоке. Без prometheus_client или при выключенных метриках ничего не делает.
+    """
+    if not enabled:
+        return
+    prometheus_client.start_http_server(port)
+    logger.info("Metrics are served on :%s/metrics", port)
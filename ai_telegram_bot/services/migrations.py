@@ -0,0 +1,288 @@
+# services/migrations.py
+
+import re
+import asyncio
+import logging
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-lock, чтобы миграции не накатывали несколько процессов одновременно
+MIGRATIONS_LOCK_KEY = 7_150_001
+# Как часто пробовать взять этот lock, пока миграции накатывает другой процесс (сек)
+MIGRATIONS_LOCK_POLL = 1.0
+
+_CONCURRENT_INDEX_RE = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.I)
+
+
+# Размер пачки для переноса данных в больших таблицах
+BACKFILL_BATCH_SIZE = 5000
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    # SQL-запросы или корутины async def step(conn) для переноса данных пачками
+    statements: list
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции, а перенос данных пачками
+    # не должен держать блокировки до конца миграции — такие миграции выполняются без BEGIN/COMMIT
+    concurrent: bool = False
+
+
+async def _backfill_text_hashes(conn):
+    """
+    Считает posts.text_hash пачками по диапазонам post_id, каждая пачка — отдельная короткая транзакция.
+    """
+    max_post_id = await conn.fetchval("SELECT MAX(post_id) FROM posts") or 0
+    for start in range(0, max_post_id, BACKFILL_BATCH_SIZE):
+        await conn.execute(
+            """
+            UPDATE posts SET text_hash = decode(md5(text), 'hex')
+            WHERE post_id > $1 AND post_id <= $2 AND text_hash IS NULL
+            """,
+            start, start + BACKFILL_BATCH_SIZE,
+        )
+
+
+async def _release_duplicate_hashes(conn):
+    """
+    Уже сохранённые повторы не удаляем: у всех копий, кроме первой, text_hash сбрасывается в NULL,
+    и уникальный индекс их не учитывает. Проверка на повторы действует только для новых постов.
+    """
+    rows = await conn.fetch(
+        """
+        SELECT array_agg(post_id ORDER BY post_id) AS post_ids FROM posts
+        WHERE text_hash IS NOT NULL
+        GROUP BY channel_id, text_hash HAVING COUNT(*) > 1
+        """
+    )
+    duplicates = [post_id for r in rows for post_id in r["post_ids"][1:]]
+    for i in range(0, len(duplicates), BACKFILL_BATCH_SIZE):
+        await conn.execute(
+            "UPDATE posts SET text_hash = NULL WHERE post_id = ANY($1::int[])",
+            duplicates[i:i + BACKFILL_BATCH_SIZE],
+        )
+
+
+MIGRATIONS = [
+    Migration(1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id SERIAL PRIMARY KEY,
+            username TEXT,
+            telegram_id BIGINT UNIQUE,
+            created_at TIMESTAMP DEFAULT NOW(),
+            last_active TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS channels (
+            channel_id SERIAL PRIMARY KEY,
+            user_id INT REFERENCES users(user_id),
+            name TEXT,
+            created_at TIMESTAMP DEFAULT NOW(),
+            status TEXT DEFAULT 'active'
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ideas (
+            idea_id SERIAL PRIMARY KEY,
+            title TEXT UNIQUE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS styles (
+            style_id SERIAL PRIMARY KEY,
+            name TEXT UNIQUE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS posts (
+            post_id SERIAL PRIMARY KEY,
+            channel_id INT REFERENCES channels(channel_id),
+            idea_id INT REFERENCES ideas(idea_id),
+            style_id INT REFERENCES styles(style_id),
+            text TEXT,
+            published_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS logs (
+            log_id SERIAL PRIMARY KEY,
+            user_id INT REFERENCES users(user_id),
+            post_id INT REFERENCES posts(post_id),
+            event_type TEXT,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS post_suggestions (
+            channel_id INT PRIMARY KEY REFERENCES channels(channel_id),
+            fingerprint TEXT NOT NULL,
+            ideas JSONB NOT NULL,
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+    ]),
+    Migration(2, "indexes for posts, channels and logs lookups", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS posts_channel_published_idx
+        ON posts (channel_id, published_at DESC, post_id DESC)
+        """,
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS channels_user_id_idx ON channels (user_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS channels_name_idx ON channels (name)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS logs_post_id_idx ON logs (post_id)",
+    ], concurrent=True),
+    Migration(3, "llm completion cache", [
+        """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            prompt_tokens INT DEFAULT 0,
+            completion_tokens INT DEFAULT 0,
+            hits INT DEFAULT 0,
+            created_at TIMESTAMP DEFAULT NOW(),
+            last_hit_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS llm_cache_last_hit_idx ON llm_cache (last_hit_at)",
+    ]),
+    Migration(4, "bot persistence", [
+        """
+        CREATE TABLE IF NOT EXISTS bot_persistence (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data BYTEA NOT NULL,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (kind, key)
+        )
+        """,
+    ]),
+    Migration(5, "update queue for multi-worker mode", [
+        """
+        CREATE TABLE IF NOT EXISTS update_queue (
+            id BIGSERIAL PRIMARY KEY,
+            shard INT NOT NULL,
+            user_key BIGINT NOT NULL,
+            payload JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW(),
+            claimed_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS update_queue_shard_idx ON update_queue (shard, id) WHERE claimed_at IS NULL",
+    ]),
+    Migration(6, "background jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            chat_id BIGINT,
+            message_id BIGINT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress INT DEFAULT 0,
+            result JSONB,
+            error TEXT,
+            cancel_requested BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT NOW(),
+            started_at TIMESTAMP,
+            heartbeat_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS jobs_queued_idx ON jobs (job_id) WHERE status = 'queued'",
+        "CREATE INDEX IF NOT EXISTS jobs_running_idx ON jobs (heartbeat_at) WHERE status = 'running'",
+    ]),
+    Migration(7, "post embeddings for similar posts retrieval", [
+        "ALTER TABLE posts ADD COLUMN IF NOT EXISTS embedding BYTEA",
+    ]),
+    Migration(8, "post text hash column", [
+        "ALTER TABLE posts ADD COLUMN IF NOT EXISTS text_hash BYTEA",
+    ]),
+    Migration(9, "post text hashes backfill, existing duplicates kept", [
+        _backfill_text_hashes,
+        _release_duplicate_hashes,
+    ], concurrent=True),
+    Migration(10, "unique post text per channel", [
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS posts_channel_text_hash_idx ON posts (channel_id, text_hash)",
+    ], concurrent=True),
+    Migration(11, "index of posts waiting for embeddings", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS posts_without_embedding_idx
+        ON posts (channel_id) WHERE embedding IS NULL
+        """,
+    ], concurrent=True),
+]
+
+
+async def migrate(pool):
+    """
+    Накатывает недостающие миграции и записывает версию схемы в schema_version.
+    Безопасно вызывать при каждом старте: применённые версии пропускаются.
+    """
+    async with pool.acquire() as conn:
+        # Не pg_advisory_lock: процесс, ждущий в нём, держит снимок, и CREATE INDEX CONCURRENTLY
+        # у владельца lock ждал бы его вечно. Между попытками ожидающий снимков не держит
+        while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATIONS_LOCK_KEY):
+            await asyncio.sleep(MIGRATIONS_LOCK_POLL)
+        try:
+            await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT NOW()
+            )
+            """)
+            applied = {r["version"] for r in await conn.fetch("SELECT version FROM schema_version")}
+
+            for migration in MIGRATIONS:
+                if migration.version in applied:
+                    continue
+
+                logger.info("Applying migration %s: %s", migration.version, migration.description)
+                if migration.concurrent:
+                    for statement in migration.statements:
+                        await _drop_invalid_index(conn, statement)
+                        await _execute(conn, statement)
+                    await _record(conn, migration)
+                else:
+                    async with conn.transaction():
+                        # Не ждём долго блокировок на больших таблицах — лучше упасть и повторить
+                        await conn.execute("SET LOCAL lock_timeout = '5s'")
+                        for statement in migration.statements:
+                            await _execute(conn, statement)
+                        await _record(conn, migration)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_KEY)
+
+
+async def _drop_invalid_index(conn, statement):
+    """
+    Прерванный CREATE INDEX CONCURRENTLY оставляет индекс в состоянии INVALID, и повторный
+    IF NOT EXISTS его бы пропустил. Такой индекс удаляем, чтобы он построился заново.
+    """
+    if callable(statement):
+        return
+    match = _CONCURRENT_INDEX_RE.search(statement)
+    if match is None:
+        return
+    invalid = await conn.fetchval(
+        "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass($1) AND NOT indisvalid", match.group(1)
+    )
+    if invalid:
+        logger.warning("Dropping invalid index %s left by an interrupted migration", match.group(1))
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+
+async def _execute(conn, statement):
+    if callable(statement):
+        await statement(conn)
+    else:
+        await conn.execute(statement)
+
+
+async def _record(conn, migration: Migration):
+    await conn.execute(
+        "INSERT INTO schema_version (version, description) VALUES ($1, $2)",
+        migration.version, migration.description
+    )
@@ -0,0 +1,198 @@
+# services/persistence.py
+
+import asyncio
+import json
+import logging
+import pickle
+from telegram.ext import BasePersistence, PersistenceInput
+from services import database as db
+from config import PERSISTENCE_UPDATE_INTERVAL, PERSISTENCE_REFRESH, PERSISTENCE_RETRY_DELAY
+
+logger = logging.getLogger(__name__)
+
+
+def _dumps(value) -> bytes:
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _loads(data: bytes):
+    return pickle.loads(data)
+
+
+# -------------------------
+# Хранилища
+# -------------------------
+class PostgresStore:
+    """
+    Хранит состояние в таблице bot_persistence (kind, key) -> data.
+    """
+
+    async def load(self, kind: str) -> dict:
+        # PTB читает persistence в Application.initialize(), раньше post_init — поднимаем пул сами
+        await db.init_db()
+        return await db.load_persistence(kind)
+
+    async def load_item(self, kind: str, key: str):
+        return await db.load_persistence_item(kind, key)
+
+    async def save(self, upserts: list[tuple], deletes: list[tuple]):
+        await db.save_persistence(upserts, deletes)
+
+
+class MemoryStore:
+    """
+    Хранилище в памяти с тем же интерфейсом, что у PostgresStore, — для тестов и запуска без базы.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.saves = 0
+
+    async def load(self, kind: str) -> dict:
+        return {key: data for (k, key), data in self.data.items() if k == kind}
+
+    async def load_item(self, kind: str, key: str):
+        return self.data.get((kind, key))
+
+    async def save(self, upserts: list[tuple], deletes: list[tuple]):
+        self.saves += 1
+        for kind, key, data in upserts:
+            self.data[(kind, key)] = data
+        for kind, key in deletes:
+            self.data.pop((kind, key), None)
+
+
+# -------------------------
+# Persistence для PTB
+# -------------------------
+class PostgresPersistence(BasePersistence):
+    """
+    Сохраняет user_data, chat_data, bot_data и состояния ConversationHandler во внешнем хранилище,
+    чтобы незавершённые диалоги переживали перезапуск и могли обслуживаться другим процессом.
+
+    PTB раз в update_interval вызывает update_* для всех изменённых записей — они копятся
+    в памяти и записываются одной транзакцией. flush() (при остановке) пишет всё сразу.
+
+    Состояния ConversationHandler PTB читает только при старте, поэтому один и тот же
+    пользователь должен попадать в один и тот же процесс (см. очередь апдейтов).
+    """
+
+    def __init__(self, store=None, update_interval: float = PERSISTENCE_UPDATE_INTERVAL,
+                 refresh: bool = PERSISTENCE_REFRESH):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store or PostgresStore()
+        self.refresh = refresh
+        self._pending: dict[tuple[str, str], bytes | None] = {}
+        self._write_task: asyncio.Task | None = None
+        self.batches = 0
+        self.writes = 0
+
+    # Чтение при старте
+    async def get_user_data(self) -> dict:
+        return {int(key): _loads(data) for key, data in (await self.store.load("user_data")).items()}
+
+    async def get_chat_data(self) -> dict:
+        return {int(key): _loads(data) for key, data in (await self.store.load("chat_data")).items()}
+
+    async def get_bot_data(self) -> dict:
+        data = (await self.store.load("bot_data")).get("bot")
+        return _loads(data) if data is not None else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await self.store.load(f"conversation:{name}")
+        return {tuple(json.loads(key)): _loads(data) for key, data in rows.items()}
+
+    # Запись (накапливается и уходит пачкой)
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        value = None if new_state is None else _dumps(new_state)
+        self._stage(f"conversation:{name}", json.dumps(list(key)), value)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._stage("user_data", str(user_id), _dumps(data))
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._stage("chat_data", str(chat_id), _dumps(data))
+
+    async def update_bot_data(self, data: dict) -> None:
+        self._stage("bot_data", "bot", _dumps(data))
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage("user_data", str(user_id), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._stage("chat_data", str(chat_id), None)
+
+    # Обновление перед обработкой апдейта
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        """
+        При PERSISTENCE_REFRESH подтягивает user_data, записанный другим процессом.
+        Если у нас самих есть незаписанные изменения, они новее — ничего не трогаем.
+        """
+        if not self.refresh or ("user_data", str(user_id)) in self._pending:
+            return
+        data = await self.store.load_item("user_data", str(user_id))
+        if data is not None:
+            user_data.clear()
+            user_data.update(_loads(data))
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        # Фоновая запись может ждать повтора после ошибки — останавливаем её и пишем всё сами
+        if self._write_task and not self._write_task.done():
+            self._write_task.cancel()
+            await asyncio.gather(self._write_task, return_exceptions=True)
+        await self._write()
+
+    def _stage(self, kind: str, key: str, value: bytes | None):
+        self._pending[(kind, key)] = value
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_soon())
+
+    async def _write_soon(self):
+        # Пишем, пока есть что: записи, пришедшие во время сохранения или возвращённые после ошибки,
+        # не должны ждать следующего update_*
+        while self._pending:
+            # PTB вызывает update_* пачкой через gather — даём им всем отработать и пишем одним заходом
+            await asyncio.sleep(0)
+            if not await self._write():
+                await asyncio.sleep(PERSISTENCE_RETRY_DELAY)
+
+    async def _write(self) -> bool:
+        if not self._pending:
+            return True
+
+        pending, self._pending = self._pending, {}
+        upserts = [(kind, key, value) for (kind, key), value in pending.items() if value is not None]
+        deletes = [(kind, key) for (kind, key), value in pending.items() if value is None]
+        try:
+            await self.store.save(upserts, deletes)
+        except asyncio.CancelledError:
+            self._restore(pending)
+            raise
+        except Exception:
+            logger.exception("Failed to write persistence batch of %s items", len(pending))
+            self._restore(pending)
+            return False
+
+        self.batches += 1
+        self.writes += len(pending)
+        return True
+
+    def _restore(self, pending: dict):
+        # Вернём в очередь то, что не перезаписали за это время более свежими данными
+        for item, value in pending.items():
+            self._pending.setdefault(item, value)
@@ -0,0 +1,83 @@
+# services/prompt_builder.py
+
+import logging
+from config import PROMPT_HISTORY_TOKEN_BUDGET, PROMPT_POST_TOKEN_LIMIT
+
+logger = logging.getLogger(__name__)
+
+# Кодировка gpt-4o / gpt-4o-mini. Файл словаря tiktoken кладёт в кэш (TIKTOKEN_CACHE_DIR)
+# при первом запуске; если tiktoken нет или словарь недоступен офлайн — считаем приблизительно.
+ENCODING_NAME = "o200k_base"
+CHARS_PER_TOKEN = 3     # грубая оценка для русского текста без tiktoken
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(ENCODING_NAME)
+        except Exception:
+            logger.warning("tiktoken is unavailable, falling back to approximate token counting")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, limit: int) -> str:
+    """
+    Обрезает текст до limit токенов, добавляя многоточие, если что-то отрезано.
+    """
+    if limit <= 0:
+        return ""
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        if len(tokens) <= limit:
+            return text
+        return encoding.decode(tokens[:limit]).rstrip() + "…"
+
+    max_chars = limit * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "…"
+
+
+def fit_history(
+    posts: list[str],
+    budget: int = PROMPT_HISTORY_TOKEN_BUDGET,
+    post_limit: int = PROMPT_POST_TOKEN_LIMIT,
+) -> list[str]:
+    """
+    Укладывает прошлые посты (от новых к старым, как их отдаёт get_last_posts) в бюджет токенов.
+    Каждый пост обрезается до post_limit; если бюджета не хватает, сначала сокращаются
+    и отбрасываются самые старые посты.
+    """
+    fitted = []
+    remaining = budget
+    for text in posts:
+        if remaining <= 0:
+            break
+        text = truncate_to_tokens(text, min(post_limit, remaining))
+        if not text:
+            break
+        fitted.append(text)
+        remaining -= count_tokens(text)
+
+    if len(fitted) < len(posts):
+        logger.info("Prompt history trimmed: kept %s of %s posts", len(fitted), len(posts))
+    return fitted
+
+
+def log_prompt_size(kind: str, prompt: str):
+    logger.info("Prompt %s: %s tokens, %s chars", kind, count_tokens(prompt), len(prompt))
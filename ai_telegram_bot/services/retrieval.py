@@ -0,0 +1,121 @@
+# services/retrieval.py
+#
+# Подбор прошлых постов канала, близких к теме нового поста (вместо «последних пяти»).
+# Векторы считаются при сохранении поста (services/embeddings.py), а здесь держится индекс
+# канала в памяти: id постов + матрица float16. При обращении индекс дочитывает только
+# посты, добавленные после последней загрузки. Векторы старых постов (сохранённых до появления
+# posts.embedding) досчитывает фоновая задача, а пока она не закончила — черновик строится по последним постам.
+
+import numpy as np
+from services import database as db
+from services import embeddings, jobs
+from services.cache import TTLCache, MISSING
+from services.executor import run_blocking
+from config import RETRIEVAL_TOP_K, RETRIEVAL_INDEX_CACHE_SIZE, RETRIEVAL_INDEX_MAX_BYTES, IMPORT_CHUNK_SIZE, JOB_STALE_AFTER
+
+# Индекс всё равно дочитывается при каждом обращении, TTL нужен только чтобы отпускать память
+INDEX_TTL = 3600
+
+def _index_bytes(index: dict) -> int:
+    return index["matrix"].nbytes + index["post_ids"].nbytes + index["stats"][1].nbytes
+
+
+# Ограничен и числом каналов, и памятью: индекс большого канала — сотни мегабайт
+_indexes = TTLCache(
+    RETRIEVAL_INDEX_CACHE_SIZE, INDEX_TTL, "retrieval_index", max_weight=RETRIEVAL_INDEX_MAX_BYTES, weigh=_index_bytes
+)
+# Каналы, для которых задача досчёта векторов уже поставлена; по истечении TTL ставим снова
+# (на случай, если задача упала)
+_backfill_requested = TTLCache(RETRIEVAL_INDEX_CACHE_SIZE, JOB_STALE_AFTER, "retrieval_backfill")
+
+
+@jobs.job_handler("embed_posts")
+async def embed_posts_job(job: jobs.Job):
+    """
+    Досчитывает векторы постов, сохранённых до появления posts.embedding.
+    """
+    channel_id = job.payload["channel_id"]
+    embedded = 0
+    while rows := await db.get_posts_without_embeddings(channel_id, IMPORT_CHUNK_SIZE):
+        vectors = await run_blocking(embeddings.embed_many, [r["text"] for r in rows])
+        await db.save_post_embeddings(
+            [(r["post_id"], embeddings.to_bytes(vector)) for r, vector in zip(rows, vectors)]
+        )
+        embedded += len(rows)
+        await job.progress(embedded, f"Посчитано векторов: {embedded}")
+    _indexes.invalidate(channel_id)
+    return {"embedded": embedded}
+
+
+async def _backfill_pending(channel_id: int) -> bool:
+    """
+    True, если у канала есть посты без векторов; тогда же ставит задачу на их досчёт.
+    """
+    if not await db.get_posts_without_embeddings(channel_id, 1):
+        return False
+    if _backfill_requested.get(channel_id) is MISSING:
+        _backfill_requested.set(channel_id, True)
+        await jobs.enqueue("embed_posts", {"channel_id": channel_id})
+    return True
+
+
+async def _load_index(channel_id: int) -> dict | None:
+    """
+    Индекс канала или None, если старые посты ещё ждут векторов (индекс по части постов
+    потом не дочитал бы их: он идёт только вперёд по post_id).
+    """
+    index = _indexes.get(channel_id)
+    if index is MISSING:
+        if await _backfill_pending(channel_id):
+            return None
+        matrix = embeddings.stack([])
+        index = {
+            "post_ids": np.zeros(0, dtype=np.int64),
+            "matrix": matrix,
+            "stats": embeddings.index_stats(matrix),
+            "last_post_id": 0,
+        }
+
+    rows = await db.get_post_embeddings(channel_id, index["last_post_id"])
+    if rows:
+        # Новый словарь, а не правка старого — его в это время может читать другой запрос
+        matrix = np.vstack([index["matrix"], embeddings.stack([r["embedding"] for r in rows])])
+        index = {
+            "post_ids": np.concatenate([index["post_ids"], np.array([r["post_id"] for r in rows], dtype=np.int64)]),
+            "matrix": matrix,
+            "stats": await run_blocking(embeddings.index_stats, matrix),
+            "last_post_id": rows[-1]["post_id"],
+        }
+    _indexes.set(channel_id, index)
+    return index
+
+
+async def similar_posts(channel_id: int, query: str, k: int = RETRIEVAL_TOP_K) -> list[str]:
+    """
+    Тексты до k постов канала, наиболее похожих на query, по убыванию сходства.
+    """
+    index = await _load_index(channel_id)
+    if index is None or not len(index["post_ids"]):
+        return []
+
+    best = await run_blocking(embeddings.top_k, index["matrix"], embeddings.embed(query), k, index["stats"])
+    post_ids = [int(index["post_ids"][i]) for i, _ in best]
+    if not post_ids:
+        return []
+
+    texts = await db.get_posts_texts(post_ids)
+    return [texts[post_id] for post_id in post_ids if post_id in texts]
+
+
+async def posts_for_draft(channel_id: int, idea: str, k: int = RETRIEVAL_TOP_K) -> list[str]:
+    """
+    Посты для промпта черновика: самые близкие к идее, а если таких мало — добиваем последними.
+    """
+    posts = await similar_posts(channel_id, idea, k)
+    if len(posts) < k:
+        for post in await db.get_last_posts(channel_id, limit=k):
+            if len(posts) >= k:
+                break
+            if post["text"] not in posts:
+                posts.append(post["text"])
+    return posts
@@ -0,0 +1,66 @@
+# services/suggestions.py
+
+import asyncio
+import hashlib
+import logging
+from services import database as db
+from services.llm import generate_post_ideas, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from config import SUGGESTIONS_REFRESH_DELAY
+
+logger = logging.getLogger(__name__)
+
+_refresh_tasks: dict[int, asyncio.Task] = {}
+
+
+def fingerprint(posts: list[str]) -> str:
+    """
+    Отпечаток истории канала: если последние посты не менялись, идеи можно не пересчитывать.
+    """
+    digest = hashlib.sha1()
+    for text in posts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+async def get_post_ideas(
+    channel_id: int, posts: list[str], user_id: int | None = None, priority: int = PRIORITY_INTERACTIVE
+) -> list[dict]:
+    """
+    Идеи для /newpost: берём из кэша в Postgres, если история канала не изменилась,
+    иначе генерируем через LLM и сохраняем.
+    """
+    fp = fingerprint(posts)
+    ideas = await db.get_suggestions(channel_id, fp)
+    if ideas:
+        return ideas
+
+    ideas = await generate_post_ideas(posts, user_id, priority)
+    await db.save_suggestions(channel_id, fp, ideas)
+    return ideas
+
+
+def schedule_refresh(channel_id: int):
+    """
+    Запускает фоновый пересчёт идей после изменения истории канала.
+    Пересчёт откладывается на SUGGESTIONS_REFRESH_DELAY, чтобы серия новых постов
+    (ручной ввод, импорт) вызвала одну генерацию, а не по одной на пост.
+    """
+    task = _refresh_tasks.get(channel_id)
+    if task and not task.done():
+        return
+
+    _refresh_tasks[channel_id] = asyncio.create_task(_refresh(channel_id))
+
+
+async def _refresh(channel_id: int):
+    try:
+        await asyncio.sleep(SUGGESTIONS_REFRESH_DELAY)
+        posts = await db.get_last_posts(channel_id, limit=5)
+        if len(posts) < 3:
+            return
+        await get_post_ideas(channel_id, [p["text"] for p in posts], priority=PRIORITY_BACKGROUND)
+    except Exception:
+        logger.exception("Failed to refresh suggestions for channel %s", channel_id)
+    finally:
+        _refresh_tasks.pop(channel_id, None)
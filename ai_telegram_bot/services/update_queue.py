@@ -0,0 +1,193 @@
+# services/update_queue.py
+#
+# Режим BOT_MODE = "queue": лёгкий приёмник вебхуков сразу отвечает Telegram 200 и кладёт апдейт
+# в таблицу update_queue, а несколько процессов-воркеров разбирают её и прогоняют апдейты через Application.
+#
+# Апдейты раскладываются по шардам: shard = user_key % QUEUE_WORKERS. Каждым шардом владеет ровно один
+# воркер (advisory-lock), а внутри воркера апдейты одного пользователя обрабатываются строго по очереди —
+# так состояние диалогов (ConversationHandler, user_data) остаётся согласованным.
+
+import asyncio
+import json
+import logging
+from aiohttp import web
+from telegram import Bot, Update
+from telegram.ext import Application
+from services import database as db
+from config import (
+    TELEGRAM_TOKEN,
+    WEBHOOK_URL,
+    WEBHOOK_PORT,
+    QUEUE_WORKERS,
+    QUEUE_BATCH_SIZE,
+    QUEUE_MAX_INFLIGHT,
+    QUEUE_POLL_INTERVAL,
+    QUEUE_ERROR_BACKOFF_MAX,
+)
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-lock для владения шардом (второй аргумент — номер шарда)
+SHARD_LOCK_KEY = 7_150_002
+
+
+def user_key(payload: dict) -> int:
+    """
+    Ключ упорядочивания апдейта: id отправителя, иначе id чата, иначе сам update_id.
+    """
+    for value in payload.values():
+        if not isinstance(value, dict):
+            continue
+        for field in ("from", "user"):
+            if isinstance(value.get(field), dict):
+                return value[field]["id"]
+        if isinstance(value.get("chat"), dict):
+            return value["chat"]["id"]
+    return payload.get("update_id", 0)
+
+
+def shard_of(key: int) -> int:
+    return key % QUEUE_WORKERS
+
+
+# -------------------------
+# Приёмник вебхуков
+# -------------------------
+async def _handle_webhook(request: web.Request) -> web.Response:
+    body = await request.text()
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return web.Response(status=400)
+
+    key = user_key(payload)
+    await db.enqueue_update(shard_of(key), key, body)
+    return web.Response()
+
+
+async def _on_receiver_startup(app: web.Application):
+    await db.init_db()
+    async with Bot(TELEGRAM_TOKEN) as bot:
+        await bot.set_webhook(url=f"{WEBHOOK_URL}/{TELEGRAM_TOKEN}")
+
+
+async def _on_receiver_cleanup(app: web.Application):
+    await db.close_db()
+
+
+def run_receiver():
+    """
+    Принимает вебхуки Telegram и складывает апдейты в очередь. Блокирует до остановки процесса.
+    """
+    app = web.Application()
+    app.router.add_post(f"/{TELEGRAM_TOKEN}", _handle_webhook)
+    app.on_startup.append(_on_receiver_startup)
+    app.on_cleanup.append(_on_receiver_cleanup)
+    web.run_app(app, host="0.0.0.0", port=WEBHOOK_PORT)
+
+
+# -------------------------
+# Воркер
+# -------------------------
+class QueueConsumer:
+    """
+    Разбирает очередь одного шарда и передаёт апдейты в application.process_update.
+    Разные пользователи обрабатываются параллельно (до QUEUE_MAX_INFLIGHT), апдейты одного
+    пользователя — цепочкой, каждый после завершения предыдущего.
+    """
+
+    def __init__(self, application: Application, shard: int):
+        self.application = application
+        self.shard = shard
+        self._chains: dict[int, asyncio.Task] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self.processed = 0
+        self.failed = 0
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+    async def run(self):
+        async with db.pool.acquire() as conn:
+            logger.info("Waiting for ownership of shard %s", self.shard)
+            await conn.execute("SELECT pg_advisory_lock($1, $2)", SHARD_LOCK_KEY, self.shard)
+            try:
+                await db.release_updates(self.shard)
+                await conn.add_listener(db.UPDATE_QUEUE_CHANNEL, self._on_notify)
+                logger.info("Consuming shard %s", self.shard)
+                await self._consume()
+                await conn.remove_listener(db.UPDATE_QUEUE_CHANNEL, self._on_notify)
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1, $2)", SHARD_LOCK_KEY, self.shard)
+
+        logger.info("Shard %s stopped: processed=%s failed=%s", self.shard, self.processed, self.failed)
+
+    def _on_notify(self, conn, pid, channel, payload):
+        if payload == str(self.shard):
+            self._wake.set()
+
+    async def _consume(self):
+        failures = 0
+        while not self._stopping:
+            if len(self._tasks) >= QUEUE_MAX_INFLIGHT:
+                await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            self._wake.clear()
+            try:
+                rows = await db.claim_updates(self.shard, min(QUEUE_BATCH_SIZE, QUEUE_MAX_INFLIGHT - len(self._tasks)))
+                failures = 0
+            except Exception:
+                # Временный сбой БД: ждём и пробуем снова, а не роняем процесс шарда
+                failures += 1
+                logger.exception("Failed to claim updates for shard %s, retrying", self.shard)
+                await asyncio.sleep(min(QUEUE_POLL_INTERVAL * 2 ** (failures - 1), QUEUE_ERROR_BACKOFF_MAX))
+                continue
+
+            if not rows:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), QUEUE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for row in rows:
+                self._submit(row)
+
+        # Дорабатываем уже взятые апдейты, новые не берём
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+
+    def _submit(self, row: dict):
+        key = row["user_key"]
+        task = asyncio.create_task(self._process(row, self._chains.get(key)))
+        self._chains[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._done(t, key))
+
+    def _done(self, task: asyncio.Task, key: int):
+        self._tasks.discard(task)
+        if self._chains.get(key) is task:
+            del self._chains[key]
+
+    async def _process(self, row: dict, previous: asyncio.Task | None):
+        if previous is not None:
+            await asyncio.wait({previous})
+
+        try:
+            update = Update.de_json(json.loads(row["payload"]), self.application.bot)
+            await self.application.process_update(update)
+            self.processed += 1
+        except Exception:
+            # Ошибки обработчиков PTB ловит сам; сюда попадает только битый апдейт — повторять его незачем
+            self.failed += 1
+            logger.exception("Failed to process queued update %s", row["id"])
+
+        try:
+            await db.ack_update(row["id"])
+        except Exception:
+            # Апдейт останется взятым; release_updates() вернёт его в очередь при перезапуске шарда
+            logger.exception("Failed to ack queued update %s", row["id"])
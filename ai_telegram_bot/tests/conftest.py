@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули бота импортируются так же, как при запуске из каталога ai_telegram_bot
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,128 @@
+import asyncio
+import pickle
+from services import persistence
+from services.persistence import MemoryStore, PostgresPersistence
+
+
+class SlowStore(MemoryStore):
+    """
+    MemoryStore, который пишет с задержкой и первые fail_first записей проваливает.
+    """
+
+    def __init__(self, delay: float = 0.0, fail_first: int = 0):
+        super().__init__()
+        self.delay = delay
+        self.fail_first = fail_first
+        self.batches = []
+
+    async def save(self, upserts, deletes):
+        await asyncio.sleep(self.delay)
+        if self.fail_first:
+            self.fail_first -= 1
+            raise ConnectionError("store is down")
+        self.batches.append(len(upserts) + len(deletes))
+        await super().save(upserts, deletes)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_updates_from_one_round_are_written_in_one_batch():
+    async def scenario():
+        store = SlowStore()
+        p = PostgresPersistence(store=store)
+        await asyncio.gather(
+            p.update_user_data(1, {"a": 1}),
+            p.update_user_data(2, {"b": 2}),
+            p.update_conversation("newpost", (1, 1), 2),
+        )
+        await asyncio.sleep(0.01)
+        return store, p
+
+    store, p = run(scenario())
+    assert store.batches == [3]
+    assert pickle.loads(store.data[("user_data", "1")]) == {"a": 1}
+    assert p.batches == 1 and p.writes == 3
+
+
+def test_items_staged_during_a_write_are_written_without_another_update():
+    async def scenario():
+        store = SlowStore(delay=0.05)
+        p = PostgresPersistence(store=store)
+        await p.update_user_data(1, {"a": 1})
+        await asyncio.sleep(0.01)
+        await p.update_user_data(2, {"b": 2})
+        await asyncio.sleep(0.2)
+        return store, p
+
+    store, p = run(scenario())
+    assert set(store.data) == {("user_data", "1"), ("user_data", "2")}
+    assert not p._pending
+
+
+def test_failed_batch_is_retried(monkeypatch):
+    monkeypatch.setattr(persistence, "PERSISTENCE_RETRY_DELAY", 0.01)
+
+    async def scenario():
+        store = SlowStore(fail_first=2)
+        p = PostgresPersistence(store=store)
+        await p.update_user_data(1, {"a": 1})
+        await asyncio.sleep(0.2)
+        return store, p
+
+    store, p = run(scenario())
+    assert pickle.loads(store.data[("user_data", "1")]) == {"a": 1}
+    assert store.fail_first == 0
+    assert not p._pending
+
+
+def test_newer_data_wins_over_a_failed_batch(monkeypatch):
+    monkeypatch.setattr(persistence, "PERSISTENCE_RETRY_DELAY", 0.05)
+
+    async def scenario():
+        store = SlowStore(delay=0.02, fail_first=1)
+        p = PostgresPersistence(store=store)
+        await p.update_user_data(1, {"v": "old"})
+        await asyncio.sleep(0.01)
+        await p.update_user_data(1, {"v": "new"})
+        await asyncio.sleep(0.3)
+        return store
+
+    store = run(scenario())
+    assert pickle.loads(store.data[("user_data", "1")]) == {"v": "new"}
+
+
+def test_flush_writes_everything_and_drops_deleted(monkeypatch):
+    monkeypatch.setattr(persistence, "PERSISTENCE_RETRY_DELAY", 10)
+
+    async def scenario():
+        store = SlowStore(fail_first=1)
+        store.data[("user_data", "3")] = pickle.dumps({})
+        p = PostgresPersistence(store=store)
+        await p.update_user_data(1, {"a": 1})
+        await p.drop_user_data(3)
+        await asyncio.sleep(0.01)
+        # Фоновая запись провалилась и ждёт повтора — flush() не должен её дожидаться
+        await asyncio.wait_for(p.flush(), 1)
+        return store, p
+
+    store, p = run(scenario())
+    assert set(store.data) == {("user_data", "1")}
+    assert not p._pending
+
+
+def test_state_is_read_back_after_restart():
+    async def scenario():
+        store = MemoryStore()
+        p = PostgresPersistence(store=store)
+        await p.update_user_data(7, {"selected_channel": {"channel_id": 1}})
+        await p.update_conversation("newpost", (7, 7), 1)
+        await p.flush()
+
+        restarted = PostgresPersistence(store=store)
+        return await restarted.get_user_data(), await restarted.get_conversations("newpost")
+
+    user_data, conversations = run(scenario())
+    assert user_data == {7: {"selected_channel": {"channel_id": 1}}}
+    assert conversations == {(7, 7): 1}